@@ -0,0 +1,473 @@
+#!/usr/bin/env python3
+
+import argparse
+import asyncio
+import csv
+import hashlib
+import json
+import logging
+import os
+import re
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from html.parser import HTMLParser
+from urllib.parse import urljoin, urlsplit, unquote
+
+try:
+    import aiohttp
+except ImportError as e:
+    # Not 1, that's broken links
+    print(f"ERROR:  {e}, pip3 install -r .ci/checks/requirements.txt", file=sys.stderr)
+    sys.exit(2)
+
+DESC = """ Check the links in the hugo site in public/, and write them to a csv in the same format as linkchecker.
+
+Internal links and images are looked up in public/ directly.  External links are checked over http, with
+the results cached for a while, so re-running this doesn't hammer the same sites.
+"""
+
+THIS_DIR = os.path.dirname(os.path.realpath(__file__))
+ROOT = os.path.dirname(os.path.dirname(THIS_DIR))
+
+PUBLIC = os.path.join(ROOT, "public")
+HUGO_CONFIG = os.path.join(ROOT, "config.toml")
+CONTENT_EN = os.path.join(ROOT, "content", "en")
+CACHE = os.path.join(ROOT, ".cache", "external-links.json")
+STATE = os.path.join(ROOT, ".cache", "link-check-state.json")
+
+# The columns linkchecker writes with -F csv, which report_broken_links.py reads
+FIELDS = ["urlname", "parentname", "baseref", "result", "warningstring", "infostring", "valid", "url", "line",
+          "column", "name", "dltime", "size", "checktime", "cached", "level", "modified"]
+
+# tag => attributes that link to something
+LINK_ATTRIBUTES = {
+    "a": ["href"],
+    "area": ["href"],
+    "img": ["src"],
+    "link": ["href"],
+    "script": ["src"],
+    "iframe": ["src"],
+    "source": ["src"],
+    "video": ["src"],
+    "audio": ["src"],
+}
+
+# Top level only, hugo's keys are case insensitive
+BASE_URL_SETTING = re.compile(r'^baseurl\s*=\s*["\']([^"\']+)["\']', re.IGNORECASE | re.MULTILINE)
+
+SKIPPED_SCHEMES = ["mailto", "javascript", "tel", "data", "ftp"]
+
+# Servers that don't like HEAD requests, give them a GET instead
+RETRY_WITH_GET = [403, 404, 405, 501]
+
+LOG = logging.getLogger(__name__)
+
+
+def _setup_logging():
+    LOG.setLevel(logging.INFO)
+    ch = logging.StreamHandler()
+    formatter = logging.Formatter('%(levelname)s:  %(message)s')
+    ch.setFormatter(formatter)
+    LOG.addHandler(ch)
+
+
+class LinkParser(HTMLParser):
+    """ Collects (url, line, column, name) for every link in a page """
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.links = []
+        self.base = None
+        self.anchor = None  # the <a> whose text we're collecting
+
+    def handle_starttag(self, tag, attrs):
+        attrs = dict(attrs)
+        if tag == "base" and attrs.get("href"):
+            self.base = attrs["href"]
+            return
+
+        for attribute in LINK_ATTRIBUTES.get(tag, []):
+            value = attrs.get(attribute)
+            if not value:
+                continue
+            line, column = self.getpos()
+            link = [value.strip(), line, column + 1, attrs.get("alt") or attrs.get("title") or ""]
+            self.links.append(link)
+            if tag == "a":
+                self.anchor = link
+
+    def handle_data(self, data):
+        if self.anchor is not None:
+            self.anchor[3] += data
+
+    def handle_endtag(self, tag):
+        if tag == "a" and self.anchor is not None:
+            self.anchor[3] = " ".join(self.anchor[3].split())
+            self.anchor = None
+
+
+def page_url(base_url, public, pathname):
+    """ The url this page is served at, http://host/docs/x/index.html is http://host/docs/x/ """
+    relpath = os.path.relpath(pathname, public).replace(os.sep, "/")
+    if relpath == "index.html":
+        relpath = ""
+    elif relpath.endswith("/index.html"):
+        relpath = relpath[:-len("index.html")]
+    return base_url + "/" + relpath
+
+
+def parse_page(base_url, public, pathname):
+    """ Returns (page url, [(link, absolute url, line, column, name)]), runs in a worker process """
+    url = page_url(base_url, public, pathname)
+    parser = LinkParser()
+    with open(pathname, 'r', encoding='utf-8', errors='replace') as f:
+        parser.feed(f.read())
+    parser.close()
+
+    base = urljoin(url, parser.base) if parser.base else url
+    links = []
+    for link, line, column, name in parser.links:
+        if link.startswith("#"):
+            continue  # linkchecker doesn't check anchors either
+        absolute = urljoin(base, link)
+        if urlsplit(absolute).scheme in SKIPPED_SCHEMES:
+            continue
+        links.append((link, absolute, line, column, name))
+    return url, links
+
+
+def find_pages(public):
+    for root, dirs, files in os.walk(public):
+        dirs.sort()
+        for name in sorted(files):
+            if name.endswith(".html"):
+                yield os.path.join(root, name)
+
+
+def hugo_base_url(config):
+    """ The baseURL hugo built public/ with, which permalinks and absURL links start with, or None """
+    if os.environ.get("HUGO_BASEURL"):
+        return os.environ["HUGO_BASEURL"]
+    try:
+        with open(config, 'r') as f:
+            m = BASE_URL_SETTING.search(f.read().split("\n[", 1)[0])
+    except OSError:
+        return None
+    return m.group(1) if m else None
+
+
+def is_internal(url, internal_urls):
+    return any(url == prefix or url.startswith(prefix + "/") for prefix in internal_urls)
+
+
+def check_internal(url, internal_urls, public):
+    """ Is there a file in public/ for this url """
+    prefix = next(prefix for prefix in internal_urls if url == prefix or url.startswith(prefix + "/"))
+    path = unquote(urlsplit(url[len(prefix):] or "/").path)
+    pathname = os.path.join(public, path.lstrip("/"))
+    if path.endswith("/"):
+        pathname = os.path.join(pathname, "index.html")
+    if os.path.isfile(pathname):
+        return True, "200 OK"
+    if os.path.isdir(pathname) and os.path.isfile(os.path.join(pathname, "index.html")):
+        return True, "200 OK"
+    return False, "404 Not Found"
+
+
+class ResultCache:
+    """ url => {checked, valid, result}, saved as json, entries expire after ttl seconds """
+
+    def __init__(self, pathname, ttl):
+        self.pathname = pathname
+        self.ttl = ttl
+        self.entries = {}
+        if pathname and os.path.exists(pathname):
+            try:
+                with open(pathname, 'r') as f:
+                    self.entries = json.load(f)
+            except (ValueError, OSError) as e:
+                LOG.warning(f"Ignoring unreadable cache {pathname}: {e}")
+
+    def get(self, url):
+        entry = self.entries.get(url)
+        if entry and time.time() - entry["checked"] < self.ttl:
+            return entry
+        return None
+
+    def put(self, url, valid, result):
+        self.entries[url] = {"checked": time.time(), "valid": valid, "result": result}
+
+    def save(self):
+        if not self.pathname:
+            return
+        now = time.time()
+        entries = {url: entry for url, entry in self.entries.items() if now - entry["checked"] < self.ttl}
+        os.makedirs(os.path.dirname(os.path.abspath(self.pathname)), exist_ok=True)
+        tmp_pathname = self.pathname + ".tmp"
+        with open(tmp_pathname, 'w') as f:
+            json.dump(entries, f)
+        os.replace(tmp_pathname, self.pathname)
+
+
+async def _request(session, method, url):
+    async with session.request(method, url, allow_redirects=True) as response:
+        return response.status, response.reason
+
+
+async def check_external(session, semaphores, per_host, url):
+    """ Returns (valid, result, seconds) """
+    host = urlsplit(url).netloc
+    semaphore = semaphores.setdefault(host, asyncio.Semaphore(per_host))
+    async with semaphore:
+        start = time.time()
+        try:
+            status, reason = await _request(session, "HEAD", url)
+            if status in RETRY_WITH_GET:
+                status, reason = await _request(session, "GET", url)
+            return status < 400, f"{status} {reason}", time.time() - start
+        except aiohttp.ClientSSLError as e:
+            # report_broken_links.py only warns about these
+            return False, f"SSLError: {e}", time.time() - start
+        except asyncio.TimeoutError:
+            return False, "Timeout", time.time() - start
+        except (aiohttp.ClientError, ValueError) as e:
+            return False, f"{type(e).__name__}: {e}", time.time() - start
+
+
+async def check_all_external(urls, cache, concurrency, per_host, timeout):
+    """ Returns { url: (valid, result, seconds, cached) } """
+    results = {}
+    todo = []
+    for url in urls:
+        entry = cache.get(url)
+        if entry:
+            results[url] = (entry["valid"], entry["result"], 0, True)
+        else:
+            todo.append(url)
+
+    LOG.warning(f"Checking {len(todo)} external links ({len(results)} cached)")
+    if not todo:
+        return results
+
+    connector = aiohttp.TCPConnector(limit=concurrency, limit_per_host=per_host, ttl_dns_cache=300)
+    headers = {"User-Agent": "corda-docs-check-links/1.0"}
+    semaphores = {}
+    async with aiohttp.ClientSession(connector=connector, headers=headers,
+                                     timeout=aiohttp.ClientTimeout(total=timeout)) as session:
+        checked = await asyncio.gather(*[check_external(session, semaphores, per_host, url) for url in todo])
+
+    for url, (valid, result, seconds) in zip(todo, checked):
+        cache.put(url, valid, result)
+        results[url] = (valid, result, seconds, False)
+    return results
+
+
+def source_pathname(args, pathname):
+    """ The markdown a page was built from, if there is one """
+    relpath = os.path.relpath(pathname, args.public)
+    if os.path.basename(relpath) == "index.html":
+        candidates = ["_index.md", "index.md"]
+        dirname = os.path.dirname(relpath)
+    else:
+        candidates = [os.path.basename(relpath)[:-len(".html")] + ".md"]
+        dirname = os.path.dirname(relpath)
+    for candidate in candidates:
+        md = os.path.join(args.content, dirname, candidate)
+        if os.path.isfile(md):
+            return md
+    return None
+
+
+def page_hash(args, pathname):
+    """ Hash of the page's markdown, or of the html for pages hugo generates without any """
+    md5 = hashlib.md5()
+    with open(source_pathname(args, pathname) or pathname, 'rb') as f:
+        md5.update(f.read())
+    return md5.hexdigest()
+
+
+def load_state(pathname, base_url):
+    """ { html relpath: { hash, url, links: [[link, url, line, column, name, valid, result]] } } """
+    if not os.path.exists(pathname):
+        return {}
+    try:
+        with open(pathname, 'r') as f:
+            data = json.load(f)
+        return data["pages"] if data.get("base_url") == base_url else {}
+    except (ValueError, KeyError, OSError) as e:
+        LOG.warning(f"Ignoring unreadable state {pathname}: {e}")
+        return {}
+
+
+def save_state(pathname, base_url, pages):
+    os.makedirs(os.path.dirname(os.path.abspath(pathname)), exist_ok=True)
+    tmp_pathname = pathname + ".tmp"
+    with open(tmp_pathname, 'w') as f:
+        json.dump({"base_url": base_url, "pages": pages}, f)
+    os.replace(tmp_pathname, pathname)
+
+
+def parse_pages(args, base_url, pages):
+    LOG.warning(f"Parsing {len(pages)} pages in {args.public}")
+    with ProcessPoolExecutor(max_workers=args.jobs) as executor:
+        return list(executor.map(parse_page, [base_url] * len(pages), [args.public] * len(pages), pages,
+                                 chunksize=32))
+
+
+def check_links(args):
+    """ Returns the number of broken links """
+    base_url = args.base_url.rstrip("/")
+    internal_urls = [base_url] + [url.rstrip("/") for url in args.internal_url]
+    hugo_url = hugo_base_url(args.hugo_config)
+    if hugo_url and hugo_url.rstrip("/") not in internal_urls:
+        internal_urls.append(hugo_url.rstrip("/"))
+    ignore = [re.compile(pattern) for pattern in args.ignore_url]
+
+    pages = list(find_pages(args.public))
+    previous = load_state(args.state, base_url) if args.incremental else {}
+    hashes = {}
+    changed = pages
+    if args.incremental:
+        hashes = {page: page_hash(args, page) for page in pages}
+        changed = [page for page in pages
+                   if previous.get(os.path.relpath(page, args.public), {}).get("hash") != hashes[page]]
+        LOG.warning(f"{len(changed)} of {len(pages)} pages changed since the last run")
+
+    # { page: (url, [[link, url, line, column, name, valid, result]]) }, valid and result are
+    # only known for the links of unchanged pages, from the last run
+    links_by_page = {}
+    changed_set = set(changed)
+    for page in pages:
+        state = previous.get(os.path.relpath(page, args.public))
+        if state and page not in changed_set:
+            links_by_page[page] = (state["url"], state["links"])
+    for page, (url, links) in zip(changed, parse_pages(args, base_url, changed)):
+        links_by_page[page] = (url, [list(link) + [None, None] for link in links])
+
+    # Only changed pages are parsed again, but every link is checked.  Internal ones are cheap, and
+    # checking them again catches pages linking to something that has been moved or deleted.
+    # External ones come from the ResultCache, so they are only checked again once --cache-ttl is up.
+    external = {}
+    for page_url, links in links_by_page.values():
+        for link, url, line, column, name, valid, result in links:
+            if not is_internal(url, internal_urls) and not any(p.match(url) for p in ignore):
+                external[url.split("#")[0]] = None
+
+    results = {}
+    if args.check_extern:
+        cache = ResultCache(None if args.no_cache else args.cache, args.cache_ttl)
+        results = asyncio.run(check_all_external(list(external), cache, args.concurrency, args.per_host,
+                                                 args.timeout))
+        cache.save()
+
+    broken = 0
+    newly_broken = 0
+    checktime = int(time.time())
+    state = {}
+    with open(args.output, 'w', newline='') as f:
+        f.write(f"# created by check_links.py at {time.strftime('%Y-%m-%d %H:%M:%S')}\n")
+        writer = csv.DictWriter(f, FIELDS, delimiter=';', quotechar='"', lineterminator='\n')
+        writer.writeheader()
+        for page in pages:
+            page_url, links = links_by_page[page]
+            checked_links = []
+            for link, url, line, column, name, previous_valid, previous_result in links:
+                # Everything is kept in the state, so a later run with other options still has it
+                checked_links.append([link, url, line, column, name, previous_valid, previous_result])
+                if any(p.match(url) for p in ignore):
+                    continue
+                cached = False
+                seconds = ""
+                if is_internal(url, internal_urls):
+                    valid, result = check_internal(url, internal_urls, args.public)
+                    if previous_valid and not valid:
+                        newly_broken += 1
+                elif args.check_extern:
+                    valid, result, seconds, cached = results[url.split("#")[0]]
+                else:
+                    continue
+                checked_links[-1][5:] = [valid, result]
+                broken += 0 if valid else 1
+                writer.writerow({
+                    "urlname": link,
+                    "parentname": page_url,
+                    "baseref": page_url,
+                    "result": result,
+                    "warningstring": "",
+                    "infostring": "",
+                    "valid": str(valid),
+                    "url": url,
+                    "line": line,
+                    "column": column,
+                    "name": name,
+                    "dltime": f"{seconds:.3f}" if seconds != "" else "",
+                    "size": "",
+                    "checktime": checktime,
+                    "cached": str(cached),
+                    "level": 1,
+                    "modified": "",
+                })
+            if args.incremental:
+                state[os.path.relpath(page, args.public)] = {"hash": hashes[page], "url": page_url,
+                                                             "links": checked_links}
+
+    if args.incremental:
+        if newly_broken:
+            LOG.warning(f"{newly_broken} links in unchanged pages are now broken")
+        save_state(args.state, base_url, state)
+
+    return broken
+
+
+def main():
+    parser = argparse.ArgumentParser(description=DESC)
+    parser.add_argument("--public", default=PUBLIC, help="the hugo build to check")
+    parser.add_argument("--output", "-o", default=os.path.join(THIS_DIR, "links.csv"), help="csv file to write")
+    parser.add_argument("--base-url", default="http://docs.corda.net",
+                        help="URL the site is served at, pass the same one to report_broken_links.py")
+    parser.add_argument("--internal-url", action="append", default=[],
+                        help="other URLs that are also this site, can be repeated")
+    parser.add_argument("--hugo-config", default=HUGO_CONFIG,
+                        help="the baseURL in this (or $HUGO_BASEURL) is also this site, as hugo makes permalinks "
+                             "and absURL links with it")
+    parser.add_argument("--no-extern", dest="check_extern", default=True, action="store_false",
+                        help="only check internal links and images")
+    parser.add_argument("--ignore-url", action="append", default=[r".*\.md$"],
+                        help="regex of URLs not to check, can be repeated")
+    parser.add_argument("--concurrency", default=64, type=int, help="maximum external requests at once")
+    parser.add_argument("--per-host", default=4, type=int, help="maximum external requests at once to one host")
+    parser.add_argument("--timeout", default=30, type=float, help="seconds to wait for each external link")
+    parser.add_argument("--cache", default=CACHE, help="where to keep external link results")
+    parser.add_argument("--cache-ttl", default=24 * 60 * 60, type=int, help="seconds to trust a cached result")
+    parser.add_argument("--no-cache", default=False, action="store_true", help="check every external link again")
+    parser.add_argument("--jobs", "-j", default=None, type=int, help="processes to parse pages with")
+    parser.add_argument("--incremental", "-i", default=False, action="store_true",
+                        help="only parse the pages whose markdown changed since the last incremental run, reusing "
+                             "the links found in the rest")
+    parser.add_argument("--state", default=STATE, help="where --incremental keeps the links of each page")
+    parser.add_argument("--content", default=CONTENT_EN, help="the markdown public/ was built from")
+
+    args = parser.parse_args()
+
+    _setup_logging()
+
+    if not os.path.isdir(args.public):
+        LOG.error(f"No site to check in {args.public}, build it first (make local-build)")
+        sys.exit(2)
+
+    start = time.time()
+    try:
+        broken = check_links(args)
+    except Exception:
+        # Not 1, that's broken links
+        LOG.exception("check_links.py failed")
+        sys.exit(2)
+    LOG.warning(f"Wrote {args.output} in {time.time() - start:.1f}s, {broken} broken links")
+
+    # Same exit codes as linkchecker:  1 is broken links, 2 is anything else
+    sys.exit(1 if broken else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+
+import argparse
+import csv
+import functools
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+DESC = """ Runs check_links.py over a small site whose external links point at a local http.server, and checks
+each link is reported valid or broken as it should be.  Exits 1 if any aren't. """
+
+THIS_DIR = os.path.dirname(os.path.realpath(__file__))
+
+BASE_URL = "http://docs.example.com"
+HUGO_BASE_URL = "http://localhost:1313"
+
+
+class QuietHandler(SimpleHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+def unused_port():
+    """ A port nothing is listening on, so connecting to it is refused """
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def make_site(public, server_url, refused_url):
+    """ Returns { url: expected valid } for the links in the site """
+    expected = {
+        f"{server_url}/ok.html": True,
+        f"{server_url}/missing.html": False,
+        refused_url: False,
+        f"{BASE_URL}/page.html": True,
+        f"{BASE_URL}/gone.html": False,
+        f"{HUGO_BASE_URL}/page.html": True,
+    }
+    with open(os.path.join(public, "index.html"), 'w') as f:
+        f.write("<html><body>\n")
+        for url in expected:
+            f.write(f'<a href="{url}">link</a>\n')
+        f.write("</body></html>\n")
+    with open(os.path.join(public, "page.html"), 'w') as f:
+        f.write("<html><body>page</body></html>\n")
+    return expected
+
+
+def main():
+    argparse.ArgumentParser(description=DESC).parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        served = os.path.join(tmp_dir, "served")
+        public = os.path.join(tmp_dir, "public")
+        os.makedirs(served)
+        os.makedirs(public)
+        with open(os.path.join(served, "ok.html"), 'w') as f:
+            f.write("ok\n")
+
+        server = ThreadingHTTPServer(("127.0.0.1", 0), functools.partial(QuietHandler, directory=served))
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        try:
+            server_url = f"http://127.0.0.1:{server.server_address[1]}"
+            expected = make_site(public, server_url, f"http://127.0.0.1:{unused_port()}/")
+
+            hugo_config = os.path.join(tmp_dir, "config.toml")
+            with open(hugo_config, 'w') as f:
+                f.write(f'baseURL = "{HUGO_BASE_URL}/"\ntitle = "Test"\n\n[params]\nbaseURL = "http://elsewhere"\n')
+
+            output = os.path.join(tmp_dir, "links.csv")
+            process = subprocess.run([sys.executable, os.path.join(THIS_DIR, "check_links.py"),
+                                      "--public", public, "--base-url", BASE_URL, "--hugo-config", hugo_config,
+                                      "--output", output,
+                                      "--no-cache", "--timeout", "10"])
+        finally:
+            server.shutdown()
+
+        if process.returncode != 1:
+            print(f"FAIL:  check_links.py exited {process.returncode}, expected 1 for the broken links")
+            sys.exit(1)
+
+        with open(output, 'r') as f:
+            rows = {row["url"]: row for row in csv.DictReader((line for line in f if not line.startswith("#")),
+                                                                delimiter=';')}
+
+    failed = 0
+    for url, valid in expected.items():
+        row = rows.get(url)
+        if row is None:
+            print(f"FAIL:  {url} is missing from the csv")
+            failed += 1
+        elif row["valid"] != str(valid):
+            print(f"FAIL:  {url} was {row['valid']} ({row['result']}), expected {valid}")
+            failed += 1
+        else:
+            print(f"ok:    {url} {row['result']}")
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,312 @@
+#!/usr/bin/env python3
+
+import argparse
+import logging
+import os
+import posixpath
+import re
+import sys
+import time
+import unicodedata
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from urllib.parse import unquote
+
+import yaml
+
+DESC = """ Check the relative links, images and anchors in the markdown in content/en, without building the site.
+
+Every page is parsed once for its links, heading anchors and aliases, one process per version, and then each
+link is resolved the way the site would resolve it:  .md links like the render-link.html hook does, everything
+else as a url against the pages, aliases and static files hugo would publish.
+"""
+
+THIS_DIR = os.path.dirname(os.path.realpath(__file__))
+ROOT = os.path.dirname(os.path.dirname(THIS_DIR))
+
+CONTENT_EN = os.path.join(ROOT, "content", "en")
+STATIC = [os.path.join(ROOT, "static"), os.path.join(ROOT, "themes", "hugo-r3-theme", "static")]
+
+try:
+    YAML_LOADER = yaml.CSafeLoader
+except AttributeError:
+    YAML_LOADER = yaml.SafeLoader
+
+FENCE = re.compile(r"^\s*(```|~~~)")
+CODE_SPAN = re.compile(r"(`+)(?:(?!\1).)*?\1")
+HEADING = re.compile(r"^ {0,3}(#{1,6})\s+(.*?)(?:\s+#+)?\s*$")
+HEADING_ID = re.compile(r"\s*\{\s*#([^\s}]+)[^}]*\}\s*$")
+HTML_ID = re.compile(r"<[^>]*?\b(?:id|name)\s*=\s*[\"']([^\"']+)[\"']")
+INLINE_LINK = re.compile(r"\]\(\s*<?([^)\s>]+)")
+REFERENCE_LINK = re.compile(r"^ {0,3}\[[^\]]+\]:\s*<?([^\s>]+)")
+HTML_LINK = re.compile(r"<[^>]*?\b(?:href|src)\s*=\s*[\"']([^\"']+)[\"']")
+SCHEME = re.compile(r"^[a-zA-Z][a-zA-Z0-9+.-]*:")
+
+# Removed from heading text to get what goldmark renders, before it's turned into an id
+HEADING_MARKUP = [
+    (re.compile(r"!?\[([^\]]*)\]\([^)]*\)"), r"\1"),  # links and images, keep the text
+    (re.compile(r"<[^>]+>"), ""),  # html
+    (re.compile(r"`"), ""),
+    (re.compile(r"\*"), ""),
+    (re.compile(r"(?<!\w)_+|_+(?!\w)"), ""),  # _emphasis_ but not snake_case
+    (re.compile(r"\\(.)"), r"\1"),
+]
+
+LOG = logging.getLogger(__name__)
+
+# What a worker returns for each page:  anchors is a set of ids, links is [(line, link)], urls are the extra
+# urls the page is published at (aliases and url in its front matter)
+Page = namedtuple("Page", ["anchors", "links", "urls"])
+
+
+def _setup_logging():
+    LOG.setLevel(logging.INFO)
+    ch = logging.StreamHandler()
+    formatter = logging.Formatter('%(levelname)s:  %(message)s')
+    ch.setFormatter(formatter)
+    LOG.addHandler(ch)
+
+
+def heading_id(text):
+    """ Same as hugo's default (github) autoHeadingID """
+    for pattern, replacement in HEADING_MARKUP:
+        text = pattern.sub(replacement, text)
+    anchor = []
+    for c in text.strip():
+        if c == "-" or c.isspace():
+            anchor.append("-")
+        elif c == "_" or unicodedata.category(c)[0] in "LN":
+            anchor.append(c.lower())
+    return "".join(anchor) or "heading"
+
+
+def _front_matter(lines):
+    """ Returns (front matter dict, number of lines it takes up) """
+    if not lines or lines[0].strip() != "---":
+        return {}, 0
+    for i in range(1, len(lines)):
+        if lines[i].strip() == "---":
+            try:
+                return yaml.load("".join(lines[1:i]), Loader=YAML_LOADER) or {}, i + 1
+            except yaml.YAMLError:
+                return {}, i + 1
+    return {}, 0
+
+
+def _page_dir(relpath):
+    return "/" + posixpath.dirname(relpath.replace(os.sep, "/"))
+
+
+def parse_page(content, relpath):
+    """ Returns the Page for one markdown file """
+    with open(os.path.join(content, relpath), 'r', encoding='utf-8', errors='replace') as f:
+        lines = f.readlines()
+
+    front_matter, start = _front_matter(lines)
+    urls = []
+    if isinstance(front_matter.get("url"), str):
+        urls.append(front_matter["url"])
+    for alias in front_matter.get("aliases") or []:
+        urls.append(alias if alias.startswith("/") else posixpath.join(_page_dir(relpath), alias))
+
+    anchors = set()
+    links = []
+    headings = {}
+    fence = None
+    for number, line in enumerate(lines[start:], start + 1):
+        m = FENCE.match(line)
+        if m:
+            if fence is None:
+                fence = m.group(1)
+            elif fence == m.group(1):
+                fence = None
+            continue
+        if fence is not None:
+            continue
+
+        # Cheap tests first, most lines have nothing in them for the regexes
+        if "`" in line:
+            line = CODE_SPAN.sub("", line)
+        m = HEADING.match(line) if line.lstrip().startswith("#") else None
+        if m:
+            text = m.group(2)
+            explicit = HEADING_ID.search(text)
+            if explicit:
+                anchors.add(explicit.group(1))
+            else:
+                anchor = heading_id(text)
+                # Duplicate headings get -1, -2... like hugo
+                if anchor in headings:
+                    headings[anchor] += 1
+                    anchor = f"{anchor}-{headings[anchor]}"
+                headings.setdefault(anchor, 0)
+                anchors.add(anchor)
+
+        if "](" in line:
+            links.extend((number, link) for link in INLINE_LINK.findall(line))
+        if line.lstrip().startswith("["):
+            links.extend((number, link) for link in REFERENCE_LINK.findall(line))
+        if "<" in line:
+            anchors.update(HTML_ID.findall(line))
+            links.extend((number, link) for link in HTML_LINK.findall(line))
+
+    return Page(anchors, links, urls)
+
+
+def parse_pages(content, relpaths):
+    """ Returns { relpath: Page }, runs in a worker process """
+    return {relpath: parse_page(content, relpath) for relpath in relpaths}
+
+
+class Index:
+    """ Everything a link can point to:  the pages, their anchors and every url the site will have """
+
+    def __init__(self, content, static_dirs):
+        self.content = content
+        self.pages = {}  # md relpath => Page
+        self.urls = {}  # url path => md relpath, or None for files
+        self.basenames = {}  # md basename => [md relpath]
+        self.files = []  # markdown, relative to content
+        self.resources = []  # everything else, relative to content
+
+        for root, dirs, files in os.walk(content):
+            dirs.sort()
+            for name in sorted(files):
+                relpath = os.path.relpath(os.path.join(root, name), content)
+                (self.files if name.endswith(".md") else self.resources).append(relpath)
+
+        for relpath in self.resources:
+            self.urls["/" + relpath.replace(os.sep, "/")] = None
+        for static in static_dirs:
+            for root, dirs, files in os.walk(static):
+                for name in files:
+                    relpath = os.path.relpath(os.path.join(root, name), static)
+                    self.urls.setdefault("/" + relpath.replace(os.sep, "/"), None)
+
+    def add_pages(self, pages):
+        for relpath, page in pages.items():
+            relpath = relpath.replace(os.sep, "/")
+            self.pages[relpath] = page
+            self.basenames.setdefault(posixpath.basename(relpath), []).append(relpath)
+            for url in page_urls(relpath) + page.urls:
+                self.urls[url] = relpath
+
+    def find_md(self, page, path):
+        """ The page the render-link.html hook would find with .Page.GetPage, or None """
+        if path.startswith("/"):
+            candidates = [path.lstrip("/")]
+        else:
+            # relative to the page, then to content/en, then a unique file name anywhere
+            candidates = [posixpath.normpath(posixpath.join(posixpath.dirname(page), path)), path]
+        for candidate in candidates:
+            if candidate in self.pages:
+                return candidate
+        matches = self.basenames.get(posixpath.basename(path), [])
+        return matches[0] if len(matches) == 1 and "/" not in path else None
+
+    def find_url(self, page, path):
+        """ Returns (found, md relpath or None) for a link that isn't to markdown """
+        url = posixpath.normpath(posixpath.join(_page_dir(page), path))
+        if path.endswith("/") and url != "/":
+            url += "/"
+        for candidate in (url, url.rstrip("/") + "/", url.rstrip("/") + "/index.html"):
+            if candidate in self.urls:
+                return True, self.urls[candidate]
+        return False, None
+
+    def check(self, page, link, anchors=True):
+        """ Returns why this link is broken, or None if it isn't """
+        path, __, fragment = link.partition("#")
+        path = unquote(path.split("?")[0])
+        if not path:
+            target = page
+        elif path.endswith(".md"):
+            target = self.find_md(page, path)
+            if target is None:
+                return "missing page"
+        else:
+            found, target = self.find_url(page, path)
+            if not found:
+                return "missing page" if path.endswith(".html") or path.endswith("/") else "missing file"
+
+        if anchors and fragment and target is not None and unquote(fragment) not in self.pages[target].anchors:
+            return "missing anchor"
+        return None
+
+
+def page_urls(relpath):
+    """ Where hugo publishes a page with uglyurls = true """
+    relpath = "/" + relpath
+    dirname, basename = posixpath.split(relpath)
+    if basename in ["_index.md", "index.md"]:
+        return [dirname.rstrip("/") + "/", dirname.rstrip("/") + "/index.html"]
+    return [relpath[:-len(".md")] + ".html"]
+
+
+def is_checked(link):
+    """ Only links to this site, and nothing hugo fills in """
+    return link and not SCHEME.match(link) and not link.startswith("//") and "{{" not in link
+
+
+def _version_of(relpath):
+    """ docs/corda-os/4.4/x.md => docs/corda-os/4.4, everything outside a version is grouped together """
+    parts = relpath.split(os.sep)
+    return os.sep.join(parts[:3]) if len(parts) > 3 and parts[0] == "docs" else ""
+
+
+def check_md_links(args):
+    """ Returns [(md relpath, line, link, reason)] """
+    start = time.time()
+    index = Index(args.content, args.static)
+
+    by_version = {}
+    for relpath in index.files:
+        by_version.setdefault(_version_of(relpath), []).append(relpath)
+
+    with ProcessPoolExecutor(max_workers=args.jobs) as executor:
+        for pages in executor.map(parse_pages, [args.content] * len(by_version), by_version.values()):
+            index.add_pages(pages)
+    LOG.warning(f"Indexed {len(index.pages)} pages in {len(by_version)} versions in {time.time() - start:.1f}s")
+
+    broken = []
+    for relpath, page in index.pages.items():
+        if args.path and not any(relpath.startswith(p) for p in args.path):
+            continue
+        for line, link in page.links:
+            if not is_checked(link):
+                continue
+            reason = index.check(relpath, link, anchors=args.anchors)
+            if reason:
+                broken.append((relpath, line, link, reason))
+    return broken
+
+
+def main():
+    parser = argparse.ArgumentParser(description=DESC)
+    parser.add_argument("path", nargs="*",
+                        help="only report links in pages under these paths, relative to content/en, "
+                             "e.g. docs/corda-os/4.4")
+    parser.add_argument("--content", default=CONTENT_EN, help="the markdown to check")
+    parser.add_argument("--static", action="append", default=None,
+                        help="directories of static files, can be repeated, default is static/ and the theme's")
+    parser.add_argument("--no-anchors", dest="anchors", default=True, action="store_false",
+                        help="only check that pages and files exist, not #anchors")
+    parser.add_argument("--jobs", "-j", default=None, type=int, help="processes to parse pages with")
+
+    args = parser.parse_args()
+    args.static = args.static or STATIC
+    args.path = [p.strip("/") for p in args.path]
+
+    _setup_logging()
+
+    start = time.time()
+    broken = check_md_links(args)
+    for relpath, line, link, reason in sorted(broken):
+        print(f"{os.path.join(os.path.relpath(args.content), relpath)}:{line}: {reason}: {link}")
+    LOG.warning(f"Checked links in {time.time() - start:.1f}s, {len(broken)} broken")
+
+    sys.exit(1 if broken else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,52 +1,33 @@
 #!/usr/bin/env bash
 
+#  Checks the links in the site already built into public/ (make prod-hugo-build),
+#  reading the html from disk rather than crawling it over http.
+
 THIS_DIR="$( cd "$( dirname "${BASH_SOURCE[0]}" )" >/dev/null 2>&1 && pwd )"
 ROOT_DIR="$( cd "$( dirname $( dirname "$THIS_DIR" ))" >/dev/null 2>&1 && pwd )"
 
-IMAGE_NAME=$1
-
-echo Using docker image $IMAGE_NAME
-
-HOST="docs.corda.net"
-
-# Uses the built image outside of this script
-id=$(docker run --rm -d -v $THIS_DIR/rebase_url.sh:/entry.sh --entrypoint=/entry.sh corda-docs-nginx "http://${HOST}/")
-echo $id
-
-trap 'docker kill $id' EXIT
+if [[ ! -d $ROOT_DIR/public ]]; then
+    echo ERROR:  build the site into $ROOT_DIR/public first
+    exit 2
+fi
 
-ATTEMPTS=0
-while [ $ATTEMPTS -lt 10 ]
-do
-  ATTEMPTS=$((ATTEMPTS + 1))
-  echo "Try: ${ATTEMPTS}"
-  docker exec -it $id pidof nginx &>/dev/null && break
-  sleep 10
-done
+PYTHON="docker run -it --rm -u $(id -u):$(id -g) -e HOME=/tmp -v $ROOT_DIR:/mnt -w /mnt python:3"
 
-docker run -it --rm --link $id:${HOST} -u $(id -u):$(id -g) -v $THIS_DIR:/mnt linkchecker/linkchecker --verbose http://${HOST} --check-extern --quiet -F csv/utf-8/links.csv --ignore-url=".*\.md"
+# A failed pip install is 1 too, so make it 2 like any other failure of check_links.py
+$PYTHON sh -c "pip install --quiet --user -r .ci/checks/requirements.txt || exit 2; python .ci/checks/check_links.py --output .ci/checks/links.csv"
 STATUS=$?
 
-docker kill $id
-docker rm $id
-
 # Early exits
 # All OK
 if [[ $STATUS -eq 0 ]]; then
     exit 0
 fi
 
-# Could be a problem with docker, but likely linkchecker threw an exception
-if [[ $STATUS -eq 2 ]]; then
-    echo ERROR:  docker or linkchecker failed somehow
-    exit $STATUS
-fi
-
-# '1' is broken links according to linkchecker docs
-# https://linkchecker.github.io/linkchecker/man1/linkchecker.1.html
+# Could be a problem with docker, but likely the checker threw an exception
 if [[ $STATUS -ne 1 ]]; then
-    echo ERROR:  unknown exit code $status
+    echo ERROR:  docker or check_links.py failed somehow, exit code $STATUS
     exit $STATUS
 fi
 
-docker run -it --rm -v $THIS_DIR:/mnt -w /mnt python:3 python report_broken_links.py links.csv
+# '1' is broken links, same as linkchecker
+$PYTHON python .ci/checks/report_broken_links.py .ci/checks/links.csv
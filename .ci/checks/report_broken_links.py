@@ -2,9 +2,11 @@
 
 import argparse
 import csv
+import json
 import logging
 import os
 import sys
+from concurrent.futures import ThreadPoolExecutor
 from shutil import copyfile
 
 DESC = """ Build site locally and run linkchecker over it and report  """
@@ -17,6 +19,12 @@ STATIC = os.path.join(ROOT, "static")
 STATIC_EN = os.path.join(STATIC, "en")
 REPOS = os.path.join(ROOT, "repos")
 
+# Where basename indexes are saved between runs, None to not save them
+INDEX_CACHE = os.path.join(ROOT, ".cache", "basename-index")
+
+sys.path.insert(0, os.path.join(ROOT, "scripts"))
+from utils.search_and_replace import Replacer  # noqa: E402
+
 LOG = logging.getLogger(__name__)
 
 
@@ -28,20 +36,135 @@ def _setup_logging():
     LOG.addHandler(ch)
 
 
-def find_all(name, path, filter_string=None):
-    result = []
-    for root, dirs, files in os.walk(path):
-        if name in files:
-            pathname = os.path.join(root, name)
-            if filter_string is None or filter_string in pathname:
-                result.append(pathname)
-    return result
+class BasenameIndex:
+    """ basename => full paths of every file under root, from one walk.
+
+    Each directory's mtime is saved along with its entries, so when loaded again only
+    directories that have had files added or removed since are listed again.
+    """
+
+    def __init__(self, root, cache_pathname=None):
+        self.root = root
+        self.cache_pathname = cache_pathname
+        self.dirs = {}  # dirpath => (mtime_ns, [files], [subdirs])
+        self.paths = {}
+        self.paths_ignoring_case = {}
+
+        previous = self._load()
+        relisted = self._walk(previous)
+        LOG.debug(f"Indexed {root}: listed {relisted} of {len(self.dirs)} directories")
+        if relisted:
+            self._save()
+
+    def _load(self):
+        if not self.cache_pathname or not os.path.exists(self.cache_pathname):
+            return {}
+        try:
+            with open(self.cache_pathname, 'r') as f:
+                data = json.load(f)
+            return data["dirs"] if data.get("root") == self.root else {}
+        except (ValueError, KeyError, OSError) as e:
+            LOG.warning(f"Ignoring unreadable index {self.cache_pathname}: {e}")
+            return {}
+
+    def _save(self):
+        if not self.cache_pathname:
+            return
+        os.makedirs(os.path.dirname(self.cache_pathname), exist_ok=True)
+        tmp_pathname = self.cache_pathname + ".tmp"
+        with open(tmp_pathname, 'w') as f:
+            json.dump({"root": self.root, "dirs": self.dirs}, f)
+        os.replace(tmp_pathname, self.cache_pathname)
+
+    def _walk(self, previous):
+        """ Returns the number of directories that had to be listed """
+        relisted = 0
+        stack = [self.root]
+        while stack:
+            dirpath = stack.pop()
+            try:
+                mtime_ns = os.stat(dirpath).st_mtime_ns
+            except FileNotFoundError:
+                continue
+
+            entry = previous.get(dirpath)
+            if not entry or entry[0] != mtime_ns:
+                relisted += 1
+                files, subdirs = [], []
+                with os.scandir(dirpath) as it:
+                    for e in it:
+                        if e.is_dir(follow_symlinks=False):
+                            if e.name != '.git':
+                                subdirs.append(e.name)
+                        elif e.is_file():
+                            files.append(e.name)
+                entry = (mtime_ns, files, subdirs)
+
+            self.dirs[dirpath] = entry
+            for name in entry[1]:
+                self._add(name, os.path.join(dirpath, name))
+            stack.extend(os.path.join(dirpath, d) for d in reversed(entry[2]))
+        return relisted
+
+    def _add(self, name, pathname):
+        self.paths.setdefault(name, []).append(pathname)
+        self.paths_ignoring_case.setdefault(name.lower(), []).append(pathname)
+
+    def add(self, pathname):
+        """ Record a file we've just written """
+        name = os.path.basename(pathname)
+        if pathname not in self.paths.get(name, []):
+            self._add(name, pathname)
+
+    def find(self, name, ignore_case=False):
+        if ignore_case:
+            return self.paths_ignoring_case.get(name.lower(), [])
+        return self.paths.get(name, [])
+
+
+# { root: BasenameIndex }, each built at most once
+BASENAME_INDEXES = {}
+
+
+def basename_index(root):
+    index = BASENAME_INDEXES.get(root)
+    if index is None:
+        LOG.debug(f"Indexing {root}")
+        cache_pathname = None
+        if INDEX_CACHE:
+            cache_pathname = os.path.join(INDEX_CACHE, os.path.relpath(root, ROOT).replace(os.sep, "-") + ".json")
+        index = BasenameIndex(root, cache_pathname)
+        BASENAME_INDEXES[root] = index
+    return index
+
+
+def find_all(name, path, ignore_case=False):
+    return basename_index(path).find(name, ignore_case)
+
 
+def without_comments(f):
+    """ The lines of the linkchecker csv that aren't comments """
+    return (line for line in f if not line.startswith('#'))
 
-def strip_comments(csv_pathname):
-    out_pathname = os.path.join(os.path.dirname(csv_pathname), "stripped-" + os.path.basename(csv_pathname))
-    open(out_pathname, 'w').writelines(line for line in open(csv_pathname) if not line.startswith('#'))
-    return out_pathname
+
+class Fixes:
+    """ The replacements to make in each markdown file, applied together at the end """
+
+    def __init__(self):
+        self.replacements_by_file = {}
+
+    def add(self, markdown_file, src, dest):
+        """ The same link is often reported many times, the first fix wins """
+        self.replacements_by_file.setdefault(markdown_file, {}).setdefault(src, dest)
+
+    def apply(self):
+        """ One rewrite per file, in parallel.  Returns the number of files changed. """
+        def fix(item):
+            markdown_file, replacements = item
+            return Replacer(replacements.items()).replace_in_file(markdown_file)
+
+        with ThreadPoolExecutor() as executor:
+            return sum(1 for count in executor.map(fix, self.replacements_by_file.items()) if count)
 
 
 def baseref_to_github(base_url, baseref):
@@ -71,10 +194,10 @@ def baseref_to_file(base_url, baseref):
     return baseref.replace(base_url, replacement_url).replace(".html", ".md")
 
 
-def suggest(root, url_name):
+def suggest(root, url_name, ignore_case=False):
     """ Look for the base name of the url in the specified folder and return a list if found """
     base_name = os.path.basename(url_name)
-    arr = find_all(base_name, root)
+    arr = find_all(base_name, root, ignore_case)
     if arr is None:
         return []
 
@@ -82,21 +205,23 @@ def suggest(root, url_name):
 
 
 def suggestions(url_name):
-    """  Look for url_name and suggest a fix if we can find it on disk """
+    """  Look for url_name and suggest a fix if we can find it on disk.  If there's
+    no file with exactly that name, one whose name only differs in case will do. """
     base_name = os.path.basename(url_name)
-    static = suggest(STATIC, base_name)
-    if static:
-        return static
+    for ignore_case in [False, True]:
+        static = suggest(STATIC, base_name, ignore_case)
+        if static:
+            return static
 
-    resource_is_in_content = suggest(CONTENT_EN, base_name)
-    if resource_is_in_content:
-        replacement = copy_suggestion_to_static(CONTENT_EN, resource_is_in_content)
-        return [replacement]
+        resource_is_in_content = suggest(CONTENT_EN, base_name, ignore_case)
+        if resource_is_in_content:
+            replacement = copy_suggestion_to_static(CONTENT_EN, resource_is_in_content)
+            return [replacement]
 
-    resource_is_in_repos = suggest(REPOS, base_name)
-    if resource_is_in_repos:
-        replacement = copy_suggestion_to_static(REPOS, resource_is_in_repos)
-        return [replacement]
+        resource_is_in_repos = suggest(REPOS, base_name, ignore_case)
+        if resource_is_in_repos:
+            replacement = copy_suggestion_to_static(REPOS, resource_is_in_repos)
+            return [replacement]
 
     LOG.error(f"UNFIXABLE FILE - MISSING IMAGE {url_name}")
     return []
@@ -108,39 +233,19 @@ def copy_suggestion_to_static(src_root, suggested_paths):
     dest = os.path.join(STATIC_EN, os.path.basename(src))
     LOG.debug(f"Copying {src} to {dest}")
     copyfile(src, dest)
+    basename_index(STATIC).add(dest)
     replacement = dest.replace(STATIC, "")
     return replacement
 
 
-def _search_and_replace(files, replacements):
-    for file in files:
-        if not os.path.isfile(file):
-            continue
-        LOG.debug(f"Checking {file}")
-        lines = open(file, 'r').readlines()
-        updated = False
-        count = 0
-        for line in lines:
-            for (value, new_value) in replacements:
-                if value in line:
-                    line = line.replace(value, new_value)
-                    lines[count] = line
-                    updated = True
-                    LOG.debug(f"Replaced! {value} with {new_value}")
-            count += 1
-        if updated:
-            LOG.debug(f"Rewritten file {file}")
-            open(file, 'w').writelines(lines)
-
-
-def _try_and_fix_image(src_url, md_pathname, url_name):
+def _try_and_fix_image(fixes, src_url, md_pathname, url_name):
     replacements = [str(item) for item in suggestions(url_name)]
 
     if replacements:
         LOG.debug(f"Fixing missing image:  {url_name} in {src_url} with {replacements[0]}")
         src = f"({url_name}"
         dest = f"({replacements[0]}"
-        _search_and_replace([md_pathname], [(src, dest)])
+        fixes.add(md_pathname, src, dest)
         return True
     else:
         LOG.error(f"Missing image:  {url_name} in {src_url} - not found on disk")
@@ -157,25 +262,25 @@ def software_and_version(path):
     return dirs[1], dirs[2]
 
 
-def _fix_page_api_link(full_url_to_file, markdown_file, resource_url):
+def _fix_page_api_link(fixes, full_url_to_file, markdown_file, resource_url):
     """ Might not be needed because we have redirects in place in nginx """
     software, version = software_and_version(markdown_file)
 
     replacement = f"https://api.corda.net/api/{software}/{version}/html/" + resource_url
     src = "(" + resource_url
     dest = "(" + replacement
-    _search_and_replace([markdown_file], [(src, dest)])
+    fixes.add(markdown_file, src, dest)
 
     LOG.debug(f"Fixed {full_url_to_file}")
 
     pass
 
 
-def _try_and_fix_page(full_url_to_file, markdown_file, resource_url):
+def _try_and_fix_page(fixes, full_url_to_file, markdown_file, resource_url):
     LOG.debug(f"{full_url_to_file} / {markdown_file} / {resource_url}")
 
     if resource_url.startswith("api/"):
-        _fix_page_api_link(full_url_to_file, markdown_file, resource_url)
+        _fix_page_api_link(fixes, full_url_to_file, markdown_file, resource_url)
         return True
 
     return False
@@ -212,12 +317,11 @@ class Results:
 
 
 def process_link_checker_file(args, csv_file):
-    stripped_pathname = strip_comments(csv_file)
-
     results = Results()
+    fixes = Fixes()
 
-    with open(stripped_pathname, newline='') as csvfile:
-        reader = csv.DictReader(csvfile, delimiter=';', quotechar='"')
+    with open(csv_file, newline='') as csvfile:
+        reader = csv.DictReader(without_comments(csvfile), delimiter=';', quotechar='"')
         count = 0
         image_count = 0
         page_count = 0
@@ -250,18 +354,21 @@ def process_link_checker_file(args, csv_file):
                 if args.ignore_images:
                     continue
                 if args.fix:
-                    _try_and_fix_image(url, markdown_file, url_name)
+                    _try_and_fix_image(fixes, url, markdown_file, url_name)
                 image_count += 1
 
             if url_name.endswith(".html"):
                 if args.ignore_pages:
                     continue
                 if args.fix:
-                    _try_and_fix_page(url, markdown_file, url_name)
+                    _try_and_fix_page(fixes, url, markdown_file, url_name)
                 page_count += 1
 
             results.add("error", localhost, _row_to_string(args.base_url, row))
 
+    if args.fix:
+        LOG.warning(f"Fixed links in {fixes.apply()} markdown files")
+
     other_count = count - (page_count + image_count)
 
     results.report()
@@ -278,6 +385,8 @@ def process_link_checker_file(args, csv_file):
 
 
 def main():
+    global INDEX_CACHE
+
     parser = argparse.ArgumentParser(description=DESC)
 
     parser.add_argument("file", help="csv file to parse")
@@ -287,9 +396,13 @@ def main():
     parser.add_argument("--check-localhost-links", default=False, action="store_true")
     parser.add_argument("--fix", default=False, action="store_true", help="Try and fix in local repo")
     parser.add_argument("--base-url", default="http://docs.corda.net", help="URL that we ran linkchecker against")
+    parser.add_argument("--no-cache", default=False, action="store_true", help=f"Don't save or reuse the file indexes in {INDEX_CACHE}")
 
     args = parser.parse_args()
 
+    if args.no_cache:
+        INDEX_CACHE = None
+
     _setup_logging()
 
     csv_file = args.file
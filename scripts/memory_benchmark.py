@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+
+import argparse
+import importlib
+import json
+import logging
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+DESC = """ Peak memory (max RSS) of a full parse_rst_files_for_menus + parse_literal_includes run over every
+version.  Uses the rst in repos/, or a synthetic tree of the given size.
+
+Each measurement runs in a fresh process.  With --baseline the scripts from another git revision are measured
+over the same tree too, so both numbers are printed side by side. """
+
+THIS_DIR = os.path.dirname(os.path.realpath(__file__))
+ROOT = os.path.dirname(THIS_DIR)
+
+LOG = logging.getLogger(__name__)
+
+PROJECTS = ["corda-os", "corda-enterprise", "cenm"]
+
+
+def _setup_logging():
+    LOG.setLevel(logging.INFO)
+    ch = logging.StreamHandler()
+    formatter = logging.Formatter('%(levelname)s:  %(message)s')
+    ch.setFormatter(formatter)
+    LOG.addHandler(ch)
+
+
+def max_rss_mb():
+    """ ru_maxrss is in KB on linux, bytes on macOS """
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return max_rss / (1024 * 1024) if sys.platform == "darwin" else max_rss / 1024
+
+
+def make_synthetic_tree(repos, versions, pages):
+    """ versions of each project, each with an index.rst whose toctrees list the pages, and pages that
+    have toctrees of their own and literalinclude some example code """
+    for project in PROJECTS:
+        for v in range(versions):
+            version_dir = os.path.join(repos, "en", "docs", project, f"4.{v}")
+            source = os.path.join(version_dir, "docs", "source")
+            code = os.path.join(version_dir, "example-code", "src")
+            os.makedirs(source)
+            os.makedirs(code)
+
+            with open(os.path.join(code, "Example.kt"), 'w') as f:
+                for i in range(20):
+                    f.write(f"// DOCSTART {i}\nfun example{i}() = {i}\n// DOCEND {i}\n")
+
+            with open(os.path.join(source, "index.rst"), 'w') as f:
+                f.write("Welcome\n=======\n\n")
+                for caption in range(0, pages, 50):
+                    f.write(f".. toctree::\n   :caption: Section {caption // 50}\n\n")
+                    for page in range(caption, min(caption + 50, pages), 5):
+                        f.write(f"   page-{page}\n")
+                    f.write("\n")
+
+            for page in range(pages):
+                with open(os.path.join(source, f"page-{page}.rst"), 'w') as f:
+                    f.write(f"Page {page}\n=========\n\nSome text.\n\n")
+                    if page % 5 == 0:
+                        f.write(".. toctree::\n\n")
+                        for child in range(page + 1, min(page + 5, pages)):
+                            f.write(f"   Child {child} <page-{child}>\n")
+                        f.write("\n")
+                    for i in range(page % 4):
+                        f.write(f".. literalinclude:: ../../example-code/src/Example.kt\n"
+                                f"   :language: kotlin\n   :start-after: DOCSTART {i}\n   :end-before: DOCEND {i}\n\n")
+
+
+def save_rst_index(scripts, repos, cache_pathname):
+    """ Parses every rst file into a saved rst index, in a process of its own so it doesn't count """
+    subprocess.run([sys.executable, os.path.realpath(__file__), "--measure", scripts, "--repos", repos,
+                    "--save-rst-index", cache_pathname], check=True, stdout=subprocess.DEVNULL)
+
+
+def measure(args):
+    """ Runs in its own process, prints the results as json """
+    # Imported here, from whichever scripts/ is being measured
+    sys.path.insert(0, args.measure)
+    parse_menus_module = importlib.import_module("utils.parse_menus")
+    parse_literal_includes_module = importlib.import_module("utils.parse_literal_includes")
+    # Where the rst files are found, and literal includes made relative to
+    for module in [parse_menus_module, parse_literal_includes_module]:
+        module.REPOS = args.repos
+        module.REPOS_ROOT = os.path.join(args.repos, "en", "docs")
+
+    if args.save_rst_index:
+        rst_index = importlib.import_module("utils.rst_index").RstIndex(args.save_rst_index)
+        for file in Path(args.repos).rglob('docs/source/**/*.rst'):
+            rst_index.directives(file)
+        rst_index.save()
+        return
+
+    # Older scripts only have the no argument versions, which parse every file under REPOS
+    rst_args = []
+    if args.rst_index:
+        rst_args = [None, importlib.import_module("utils.rst_index").RstIndex(args.rst_index)]
+
+    before = max_rss_mb()
+    start = time.time()
+
+    menus, menu_files = parse_menus_module.parse_rst_files_for_menus(*rst_args)
+    includes = parse_literal_includes_module.parse_literal_includes(*rst_args)
+
+    seconds = time.time() - start
+    after = max_rss_mb()
+
+    print(json.dumps({
+        "entries": sum(len(x) for x in menu_files.values()) + sum(len(x) for x in menus.values()),
+        "literal_includes": sum(len(x) for files_dict in includes.values() for x in files_dict.values()),
+        "seconds": seconds,
+        "before": before,
+        "after": after,
+    }))
+
+
+def run(scripts, repos, rst_index=None):
+    command = [sys.executable, os.path.realpath(__file__), "--measure", scripts, "--repos", repos]
+    if rst_index:
+        command += ["--rst-index", rst_index]
+    process = subprocess.run(command, check=True, stdout=subprocess.PIPE, text=True)
+    return json.loads(process.stdout.splitlines()[-1])
+
+
+def export_scripts(rev, dest):
+    """ scripts/ as it was at rev """
+    archive = subprocess.run(["git", "-C", ROOT, "archive", rev, "scripts"], check=True, stdout=subprocess.PIPE)
+    subprocess.run(["tar", "-x", "-C", dest], input=archive.stdout, check=True)
+    return os.path.join(dest, "scripts")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=DESC)
+    parser.add_argument("--synthetic", metavar="VERSIONS", type=int, default=None,
+                        help=f"benchmark a generated tree with this many versions of each of {', '.join(PROJECTS)}")
+    parser.add_argument("--pages", type=int, default=500, help="pages in each synthetic version")
+    parser.add_argument("--baseline", metavar="REV", default=None,
+                        help="also measure the scripts at this git revision, e.g. 4ac6905 from before __slots__ "
+                             "and interning")
+    parser.add_argument("--saved-rst-index", default=False, action="store_true",
+                        help="load the rst directives from a saved rst index, as runs after the first do, rather "
+                             "than parsing every file.  Not for a --baseline from before the rst index")
+    parser.add_argument("--measure", metavar="SCRIPTS", default=None, help=argparse.SUPPRESS)
+    parser.add_argument("--repos", default=os.path.join(ROOT, "repos"), help=argparse.SUPPRESS)
+    parser.add_argument("--rst-index", default=None, help=argparse.SUPPRESS)
+    parser.add_argument("--save-rst-index", default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.measure:
+        measure(args)
+        return
+
+    _setup_logging()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        repos = args.repos
+        if args.synthetic:
+            repos = os.path.join(tmp_dir, "repos")
+            make_synthetic_tree(repos, args.synthetic, args.pages)
+        files = len(list(Path(repos).rglob('docs/source/**/*.rst')))
+
+        scripts = {"current": THIS_DIR}
+        if args.baseline:
+            scripts[args.baseline] = export_scripts(args.baseline, tmp_dir)
+
+        for i, (name, scripts_dir) in enumerate(scripts.items()):
+            rst_index = None
+            if args.saved_rst_index:
+                rst_index = os.path.join(tmp_dir, f"rst-directives-{i}.json")
+                save_rst_index(scripts_dir, repos, rst_index)
+            result = run(scripts_dir, repos, rst_index)
+            LOG.warning(f"{name}:  {files} rst files, {result['entries']} menu entries, "
+                        f"{result['literal_includes']} literal includes in {result['seconds']:.1f}s")
+            LOG.warning(f"{name}:  Peak RSS {result['after']:.1f} MB, {result['after'] - result['before']:.1f} MB "
+                        f"more than before parsing")
+
+
+if __name__ == '__main__':
+    main()
@@ -2,6 +2,7 @@
 
 import logging
 import os
+import posixpath
 import shutil
 import sys
 import re
@@ -10,20 +11,37 @@ from pathlib import Path
 import toml
 import yaml
 import hashlib
+import json
+import io
+import itertools
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
 from sphinx.cmd.build import main as sphinx_main
 import xml.etree.ElementTree as ET
 from xml.etree.ElementTree import ParseError
-from distutils.dir_util import copy_tree
 
-from utils.parse_menus import parse_rst_files_for_menus, version, version_for_config
+from utils.parse_menus import parse_rst_files_for_menus_by_version, write_split_menus, write_if_changed, version, version_for_config, MENUS_DIR, MENUS_TOML, SPLIT_CONFIG_DIR
 from utils.parse_literal_includes import parse_literal_includes, md_relpath, github_shortcode_for
+from utils.rst_index import RstIndex
+from utils.search_and_replace import search_and_replace
+from utils.find_duplicates import find_duplicates
+from utils.copy_files import Copier, COPY_MODES, summary as copy_summary
+from utils.inventory import Inventory, RST, RESOURCE, XML, MD, CONTENT_MD, CONTENT_RESOURCE
 
 THIS_DIR = os.path.dirname(os.path.realpath(__file__))
 ROOT = os.path.dirname(THIS_DIR)
 REPOS = os.path.join(ROOT, "repos")
 CONTENT = os.path.join(ROOT, "content")
 REPOS_ROOT = os.path.join(REPOS, "en/docs") # don't rely on this.
+CACHE = os.path.join(ROOT, ".cache")
+MD_CACHE = os.path.join(CACHE, "xml-to-md")
+RESOURCE_DIGESTS = os.path.join(CACHE, "resource-digests.json")
+INVENTORY_FILE = os.path.join(CACHE, "inventory.json")
+RST_INDEX = os.path.join(CACHE, "rst-directives.json")
+MENUS_CACHE = os.path.join(CACHE, "menus.json")
+UNRESOLVED_LINKS = os.path.join(CACHE, "unresolved-links.json")
 
 LOG = logging.getLogger(__name__)
 ARGS = None
@@ -32,6 +50,12 @@ ARGS = None
 MENU_FILES = {}
 INCLUDES = {}
 
+# Every file we work on, from one walk of repos/ and content/ - see utils/inventory.py
+INVENTORY = None
+
+# Written next to each sphinx xml build (docs/xml) when running with --incremental
+XML_MANIFEST = "manifest.json"
+
 # If we're in one of these, don't add new lines.
 NO_NEWLINE_ELEMENTS = ["bullet_list", "enumerated_list", "definition_list", "entry", "list_item"]
 
@@ -305,10 +329,67 @@ class Hugo(Markdown):
         return None
 
 
+class OutputBuffer:
+    """ A sequence of text fragments.
+
+    Appending is amortised O(1), and so is splicing another buffer onto the end:
+    a large buffer is added as a single part rather than copied, and only flattened
+    when iterated.  That keeps merging contexts linear in the size of the page,
+    however deeply nested it is.
+    """
+    __slots__ = ('_parts', '_nested')
+
+    # Buffers with no more parts than this are cheaper to copy than to nest
+    SPLICE_COPY_LIMIT = 16
+
+    def __init__(self, fragments=None):
+        self._parts = [] if fragments is None else list(fragments)
+        self._nested = False
+
+    def append(self, text):
+        self._parts.append(text)
+
+    def splice(self, other):
+        """ Add other's fragments to the end.  Don't use other after this. """
+        parts = other._parts
+        if not parts:
+            return
+        if len(parts) <= self.SPLICE_COPY_LIMIT:
+            self._parts.extend(parts)
+            self._nested = self._nested or other._nested
+        else:
+            self._parts.append(other)
+            self._nested = True
+
+    def __bool__(self):
+        # Empty buffers are never spliced in, so any part means some text
+        return bool(self._parts)
+
+    def __iter__(self):
+        if not self._nested:
+            return iter(self._parts)
+        return self._iter_nested()
+
+    def _iter_nested(self):
+        # Depth first over the spliced buffers, without recursion
+        stack = [iter(self._parts)]
+        while stack:
+            for part in stack[-1]:
+                if isinstance(part, OutputBuffer):
+                    stack.append(iter(part._parts))
+                    break
+                yield part
+            else:
+                stack.pop()
+
+
 class Context:
+    """ The head and foot only ever hold a few fragments (tab titles and source links),
+    so they're plain lists.  The body can be most of the page. """
+
     def __init__(self):
         self.head = []
-        self.body = []
+        self.body = OutputBuffer()
         self.foot = []
 
     # You probably don't want this
@@ -316,7 +397,7 @@ class Context:
         self.head.append(text)
 
     def put_body(self, text):
-        self.body.append(text)
+        self.body._parts.append(text)  # the hottest path, skip a call
 
     # You probably don't want this
     def put_foot(self, text):
@@ -327,12 +408,78 @@ class Context:
 
     def __add__(self, other):
         self.head += other.head
-        self.body += other.body
+        self.body.splice(other.body)
         self.foot += other.foot
         return self
 
     def astext(self):
-        return ''.join(self.head + self.body + self.foot)
+        return ''.join(itertools.chain(self.head, self.body, self.foot))
+
+
+class StreamContext(Context):
+    """ Used when streaming, for the bottom of the context stack and for every
+    element's own context above it, up to the first context a visitor pushes.
+    The body goes straight to the writer rather than being held in memory.
+    Head and foot are tiny. """
+
+    def __init__(self, writer):
+        super(StreamContext, self).__init__()
+        self.writer = writer
+
+    def put_body(self, text):
+        self.writer.write(text)
+
+    def __add__(self, other):
+        self.head += other.head
+        self.writer.writelines(other.body)
+        self.foot += other.foot
+        return self
+
+
+class _FragmentWriter:
+    """ Collects the many tiny fragments the visitors produce and writes them
+    out to the underlying file in large chunks """
+
+    def __init__(self, f, chunk_size=64 * 1024):
+        self.f = f
+        self.chunk_size = chunk_size
+        self.fragments = []
+        self.size = 0
+
+    def write(self, text):
+        self.fragments.append(text)
+        self.size += len(text)
+        if self.size >= self.chunk_size:
+            self.flush()
+
+    def writelines(self, fragments):
+        for text in fragments:
+            self.write(text)
+
+    def flush(self):
+        self.f.write(''.join(self.fragments))
+        self.fragments = []
+        self.size = 0
+
+
+# Marks a tail that the parser hasn't got to yet
+_UNSET = object()
+
+
+class _StreamNode:
+    """ What the visitors see of an element when streaming.
+
+    The visitors only ever use the tag, attributes, text and tail, and are free
+    to overwrite text and tail.  We can't let them overwrite the real element's,
+    because iterparse is still filling those in.
+    """
+    __slots__ = ('tag', 'attrib', 'text', 'tail')
+
+    def __init__(self, e):
+        self.tag = e.tag
+        self.attrib = e.attrib
+        self.text = e.text
+        self.tail = _UNSET
 
 
 class TableContext(Context):
@@ -367,6 +514,11 @@ class Translator:
 
         self.front_matter = {"date": "2020-01-08T09:59:25Z"}
 
+        # For the anchor index:  every id and name this page declares, and the (docname, fragment)
+        # of every link to a page or anchor, docname is '' for this page
+        self.anchors = set()
+        self.links = []
+
     """Returns the final document"""
 
     def astext(self):
@@ -381,16 +533,15 @@ class Translator:
         self._context.append(ctx)
 
     def pop_context(self):
-        head = self._context[-1]
+        head = self._context.pop()
         head.finalize()
-        self._context = self._context[:-1]
         self._context[-1] += head
 
     def push_element(self, e):
         self._elements.append(e)
 
     def pop_element(self):
-        self._elements = self._elements[:-1]
+        self._elements.pop()
 
     """ reset some elements to contain exactly nothing so we don't
     render erroneous newlines """
@@ -398,22 +549,50 @@ class Translator:
         e.text = ''
         e.tail = ''
 
+    @classmethod
+    def _dispatch_table(cls):
+        """ { tag: (visit, depart) } built once per class from the visit_/depart_ methods.
+        Looked up in the class's own __dict__ so subclasses get their own table. """
+        if '_dispatch' not in cls.__dict__:
+            cls._dispatch = {
+                name[len('visit_'):]: (getattr(cls, name), getattr(cls, 'depart_' + name[len('visit_'):], visit_unsupported))
+                for name in dir(cls) if name.startswith('visit_')
+            }
+        return cls._dispatch
+
     def _walk(self, parent):
-        for e in parent:
-            self.push_element(e.tag)
-            visit_func = getattr(self, f'visit_{e.tag}', visit_unsupported)
-            depart_func = getattr(self, f'depart_{e.tag}', visit_unsupported)
+        """ Visit each element and its children in document order.
 
-            self.push_context(Context())
+        Uses an explicit stack of (element, depart function, children iterator)
+        rather than recursion, so deeply nested documents can't hit the recursion limit.
+        """
+        dispatch = self._dispatch_table()
+        unsupported = (visit_unsupported, visit_unsupported)
+
+        stack = [(None, None, iter(parent))]
+        while stack:
+            e, depart_func, children = stack[-1]
+            child = next(children, None)
+            if child is not None:
+                self.push_element(child.tag)
+                visit_func, child_depart_func = dispatch.get(child.tag, unsupported)
+
+                self.push_context(Context())
 
-            visit_func(e)
+                self._collect_anchors(child)
+                visit_func(self, child)
 
-            if e.text:
-                self.top.put_body(e.text)
+                if child.text:
+                    self.top.put_body(child.text)
 
-            self._walk(e)
+                stack.append((child, child_depart_func, iter(child)))
+                continue
 
-            depart_func(e)
+            stack.pop()
+            if e is None:
+                continue  # finished with parent itself
+
+            depart_func(self, e)
 
             if e.tail:
                 self.top.put_body(e.tail)
@@ -421,16 +600,97 @@ class Translator:
             self.pop_context()
             self.pop_element()
 
-    def walk(self, filename):
+    def walk(self, filename, tree):
+        """ Translate the already parsed xml file """
         if os.path.basename(os.path.dirname(filename)) == "resources":
             LOG.info(f"Not processing {filename} as in wrong folder")
             return
 
-        tree = ET.parse(filename)
         self.filename = filename
         self._walk([tree.getroot()])
         self._add_front_matter()
 
+    def walk_stream(self, filename, writer):
+        """ Like walk(), but parses the file incrementally and writes the body to writer
+        as it goes, so memory is bounded by the depth of the document rather than its size.
+        The head and foot are left in self.top.
+
+        Returns the set of unsupported tags found.
+        """
+        if os.path.basename(os.path.dirname(filename)) == "resources":
+            LOG.info(f"Not processing {filename} as in wrong folder")
+            return set()
+
+        self.filename = filename
+        self._context[0] = StreamContext(writer)
+        dispatch = self._dispatch_table()
+        unsupported = set()
+
+        # (element, node, depart function) for each open element
+        stack = []
+
+        # An element's text is only filled in once the parser has seen what follows it,
+        # and its tail once it has seen what follows the end tag, so each event is
+        # handled when the next one arrives.
+        pending = None
+        for event, e in ET.iterparse(filename, events=('start', 'end')):
+            if pending:
+                self._stream_event(pending[0], pending[1], stack, dispatch, unsupported)
+            pending = (event, e)
+        if pending:
+            self._stream_event(pending[0], pending[1], stack, dispatch, unsupported)
+
+        self._add_front_matter()
+        return unsupported
+
+    def _stream_event(self, event, e, stack, dispatch, unsupported):
+        if event == 'start':
+            handlers = dispatch.get(e.tag, None)
+            if handlers is None:
+                unsupported.add(e.tag)
+                handlers = (visit_unsupported, visit_unsupported)
+
+            node = _StreamNode(e)
+            self.push_element(e.tag)
+            # Keep streaming unless a visitor has pushed a context of its own that
+            # needs to see (or rewrite) everything beneath it.
+            if isinstance(self.top, StreamContext):
+                self.push_context(StreamContext(self.top.writer))
+            else:
+                self.push_context(Context())
+
+            self._collect_anchors(node)
+            handlers[0](self, node)
+
+            if node.text:
+                self.top.put_body(node.text)
+
+            stack.append((e, node, handlers[1]))
+            return
+
+        e, node, depart_func = stack.pop()
+        if node.tail is _UNSET:
+            node.tail = e.tail
+
+        depart_func(self, node)
+
+        if node.tail:
+            self.top.put_body(node.tail)
+
+        self.pop_context()
+        self.pop_element()
+
+        # Finished with it - drop it from the (partial) tree
+        e.clear()
+        if stack:
+            stack[-1][0].remove(e)
+
+    def _collect_anchors(self, node):
+        for attribute in ('ids', 'names'):
+            value = node.attrib.get(attribute)
+            if value:
+                self.anchors.update(_split_xml_list(value))
+
     def _fix_up_javadoc(self, link):
         LOG.debug("TODO: fix up javadoc")
         return '#'
@@ -597,9 +857,10 @@ class Translator:
     def visit_block_quote(self, node):
         class QuoteContext(Context):
             def finalize(self):
-                quoted = ['> {}'.format(line) for line in self.body[:1]] + self.body[1:]
+                lines = list(self.body)
+                quoted = ['> {}'.format(line) for line in lines[:1]] + lines[1:]
                 quoted = [line.replace('\n', '\n> ') for line in quoted[:-1]] + quoted[-1:]
-                self.body = quoted
+                self.body = OutputBuffer(quoted)
 
         self.push_context(QuoteContext())
 
@@ -611,7 +872,7 @@ class Translator:
 
     def depart_raw(self, node):
         # Chomp....
-        out = []
+        out = OutputBuffer()
         for line in self.top.body:
             if not any([s in line for s in ['codesets.js', 'jquery.js']]):
                 out.append(line)
@@ -629,7 +890,7 @@ class Translator:
 
     def depart_reference(self, node):
         text = "".join(self.top.body)
-        self.top.body = []
+        self.top.body = OutputBuffer()
         self.pop_context()
 
         link = '#'
@@ -642,6 +903,7 @@ class Translator:
                 __, ext = os.path.splitext(non_fragment)
                 # If it doesn't have a suffix, it's another page
                 if not ext:
+                    self.links.append(tuple(uri.split('#', 1)) if '#' in uri else (uri, ''))
                     if '#' in link:
                         link = link.replace('#', '.md#')
                     else:
@@ -655,6 +917,7 @@ class Translator:
         elif 'refid' in node.attrib:
             # Anchor link to the same page
             link = '#' + node.attrib['refid']
+            self.links.append(('', node.attrib['refid']))
 
         self.top.put_body(self.cms.link(link, text))
 
@@ -687,7 +950,7 @@ class Translator:
 
     def depart_topic(self, node):
         if node.attrib.get('names', '') == 'contents':
-            self.top.body = []  # chomp the old table of contents
+            self.top.body = OutputBuffer()  # chomp the old table of contents
             self.pop_context()
         else:
             self.top.put_body(self.cms.depart_topic())
@@ -761,14 +1024,15 @@ class Translator:
             tabs_header.append(self.cms.tab_header(item, idx))
             idx += 1
         tabs_header.append(self.cms.depart_tabs_header())
-        tabs_header = [x for x in tabs_header if x is not None]
-        self.top.body = tabs_header + self.top.body
+        body = OutputBuffer(x for x in tabs_header if x is not None)
+        body.splice(self.top.body)
+        self.top.body = body
 
         self.top.foot = []
         self.top.head = []
         self.pop_context() # tab content was written to top which we're now popping.
         if md:
-            self.top.body.append(md)
+            self.top.put_body(md)
 
         self.top.put_body(self.cms.depart_tabs())
         self.in_tabs = False
@@ -876,7 +1140,7 @@ class Translator:
 
     def depart_comment(self, node):
         # chomp comments
-        self.top.body = []
+        self.top.body = OutputBuffer()
         self.pop_context()
 
     def visit_attention(self, node):
@@ -1143,39 +1407,30 @@ class Translator:
 #  END OF CLASS
 
 # NOT A CLASS MEMBER
-def visit_unsupported(self, node):
-    print(f"Unsupported {node.tag}")
-
+def _split_xml_list(value):
+    """ docutils writes list attributes space separated, with spaces in the values escaped """
+    return [v.replace('\\ ', ' ') for v in re.split(r'(?<!\\) ', value) if v]
 
-def configure_translator(filename):
-    s = set()
 
-    try:
-        tree = ET.parse(filename)
-    except Exception as e:
-        print(f"When processing: f{filename}")
-        raise(e)
+def visit_unsupported(self, node):
+    print(f"Unsupported {node.tag}")
 
-    for e in tree.iter():
-        s.add(e.tag)
 
-    failed = False
-    for tag in s:
-        if hasattr(Translator, f'visit_{tag}'):
-            continue
+def configure_translator(filename, tree):
+    """ Check the Translator supports every tag in the parsed file """
+    unsupported = {e.tag for e in tree.iter()} - Translator._dispatch_table().keys()
+    _exit_if_unsupported(filename, unsupported)
 
-        # Not supported.
-        setattr(Translator, f'visit_{tag}', visit_unsupported)
 
+def _exit_if_unsupported(filename, unsupported):
+    for tag in sorted(unsupported):
         #  Output what the user needs to implement to support it
         print("PASTE THIS IN TO THE PYTHON\n\n\n")
         print(f"\tdef visit_{tag}(self, node):\n\t\tLOG.debug('Not implemented {tag}')")
         print("")
         print(f"\tdef depart_{tag}(self, node):\n\t\tLOG.debug('Not implemented {tag}')")
 
-        failed = True
-
-    if failed:
+    if unsupported:
         LOG.error(f"Add missing directives to continue.  Found when processing {filename}")
         sys.exit(1)
 
@@ -1192,77 +1447,348 @@ def write_frontmatter(f, front_matter):
         f.write('---\n')
 
 
-def convert_one_xml_file_to_cms_style_md(cms, filename):
-    LOG.debug(f"Processing {filename}")
+_TRANSLATOR_VERSION = None
+
+# Only set in --jobs worker processes
+_WORKER_CMS = None
+
+
+def _translator_version():
+    """ Changes whenever the code that produces the markdown changes:  this file and the whole utils package """
+    global _TRANSLATOR_VERSION
+    if _TRANSLATOR_VERSION is None:
+        sha1 = hashlib.sha1()
+        utils = sorted(str(x) for x in Path(THIS_DIR, "utils").glob("*.py"))
+        for pathname in [__file__] + utils:
+            sha1.update(_hash_file(pathname).encode())
+        _TRANSLATOR_VERSION = sha1.hexdigest()
+    return _TRANSLATOR_VERSION
+
+
+def _md_cache_key(filename):
+    """ Everything that can change the markdown we generate for this xml file """
+    key = version_for_config(filename)
+    relpath = md_relpath(filename)
+    menu_entry = MENU_FILES.get(key, {}).get(relpath, None)
+    literal_includes = INCLUDES.get(key, {}).get(relpath, None)
+
+    sha1 = hashlib.sha1()
+    sha1.update(_translator_version().encode())
+    sha1.update(os.path.relpath(filename, REPOS).encode())
+    sha1.update(_hash_file(filename).encode())
+    sha1.update(json.dumps([ARGS.cms, ARGS.toml, ARGS.toc, menu_entry, literal_includes], sort_keys=True).encode())
+    return sha1.hexdigest()
+
+
+def _md_cache_pathname(cache_key):
+    return os.path.join(MD_CACHE, cache_key[:2], cache_key + ".md")
+
+
+def _write_md_cache(cache_key, md, anchors):
+    pathname = _md_cache_pathname(cache_key)
+    os.makedirs(os.path.dirname(pathname), exist_ok=True)
+    # Write then rename, so an interrupted run never leaves a truncated entry behind.
+    # The anchors go first, an entry only counts once its markdown is there.
+    tmp_pathname = f"{pathname}.{os.getpid()}.tmp"
+    with open(tmp_pathname, 'w') as f:
+        json.dump(anchors, f)
+    os.replace(tmp_pathname, _anchors_cache_pathname(cache_key))
+    shutil.copyfile(md, tmp_pathname)
+    os.replace(tmp_pathname, pathname)
+
+
+def _anchors_cache_pathname(cache_key):
+    return os.path.join(MD_CACHE, cache_key[:2], cache_key + ".json")
+
+
+def _page_anchors(t):
+    """ What the anchor index needs from a translated page, as json """
+    return {"anchors": sorted(t.anchors), "links": t.links}
+
 
+def _translate(cms, filename):
+    """ Returns the complete markdown (front matter and content) for the xml file, and its anchors """
     try:
-        configure_translator(filename)
-        t = Translator(cms)
-        t.walk(filename)
+        tree = ET.parse(filename)
+    except Exception as e:
+        print(f"When processing: f{filename}")
+        raise(e)
 
-        md = str(filename).replace('.xml', '.md')
+    configure_translator(filename, tree)
+    t = Translator(cms)
+    t.walk(filename, tree)
+
+    f = io.StringIO()
+    write_frontmatter(f, t.front_matter)
+    f.write(t.astext())
+    return f.getvalue(), _page_anchors(t)
+
+
+def _translate_streaming(cms, filename, md):
+    """ Same output as _translate(), written to md, but never holds the whole page in memory.
+    Returns the page's anchors. """
+    t = Translator(cms)
+    with tempfile.SpooledTemporaryFile(max_size=1024 * 1024, mode='w+') as body:
+        writer = _FragmentWriter(body)
+        unsupported = t.walk_stream(filename, writer)
+        writer.flush()
+        _exit_if_unsupported(filename, unsupported)
+
+        body.seek(0)
         with open(md, 'w') as f:
             write_frontmatter(f, t.front_matter)
-            f.write(t.astext())
+            f.write(''.join(t.top.head))
+            shutil.copyfileobj(body, f)
+            f.write(''.join(t.top.foot))
+
+    return _page_anchors(t)
+
+
+def _should_stream(filename):
+    return ARGS.stream_min_size is not None and os.path.getsize(filename) >= ARGS.stream_min_size
+
+
+def convert_one_xml_file_to_cms_style_md(cms, filename):
+    """ Returns (True if the markdown came from the cache, the page's anchors, its cache key or None) """
+    LOG.debug(f"Processing {filename}")
+
+    try:
+        md = str(filename).replace('.xml', '.md')
+
+        cache_key = None
+        if not ARGS.no_cache:
+            cache_key = _md_cache_key(filename)
+            cache_pathname = _md_cache_pathname(cache_key)
+            if os.path.exists(cache_pathname):
+                shutil.copyfile(cache_pathname, md)
+                with open(_anchors_cache_pathname(cache_key), 'r') as f:
+                    return True, json.load(f), cache_key
+
+        if _should_stream(filename):
+            anchors = _translate_streaming(cms, filename, md)
+        else:
+            text, anchors = _translate(cms, filename)
+            with open(md, 'w') as f:
+                f.write(text)
+
+        if cache_key:
+            _write_md_cache(cache_key, md, anchors)
+
+        return False, anchors, cache_key
     except ParseError as e:
         line, col = e.position
         LOG.error(f"When processing: {filename}:{line}")
         raise
 
 
+def _convert_one_collecting_errors(cms, filename):
+    """ Returns (cached, anchors, cache key, error) rather than raising on a bad xml file """
+    try:
+        return convert_one_xml_file_to_cms_style_md(cms, filename) + (None,)
+    except ParseError as e:
+        return False, None, None, str(e)
+
+
+def _init_md_worker(args, menu_files, includes):
+    """  Each worker gets its own copy of the options and lookups, once, up front. """
+    global ARGS, MENU_FILES, INCLUDES, _WORKER_CMS
+    ARGS = args
+    MENU_FILES = menu_files
+    INCLUDES = includes
+    _WORKER_CMS = _cms_for(args.cms)
+
+
+def _convert_one_in_md_worker(filename):
+    return _convert_one_collecting_errors(_WORKER_CMS, filename)
+
+
 def convert_all_xml_to_md(cms):
     LOG.warning("Converting all xml => md")
 
-    files = [x for x in Path(REPOS).rglob('xml/xml/**/*.xml')]
-    for x in files:
-        convert_one_xml_file_to_cms_style_md(cms, x)
+    # Sorted, so that the failures are always reported in the same order
+    files = sorted(INVENTORY.files(XML))
+    if ARGS.jobs > 1:
+        LOG.warning(f"Converting using {ARGS.jobs} processes")
+        with ProcessPoolExecutor(max_workers=ARGS.jobs, initializer=_init_md_worker,
+                                 initargs=(ARGS, MENU_FILES, INCLUDES)) as executor:
+            results = list(executor.map(_convert_one_in_md_worker, files, chunksize=16))
+    else:
+        results = [_convert_one_collecting_errors(cms, x) for x in files]
+
+    cached = sum(1 for is_cached, __, __, __ in results if is_cached)
+    failures = [(x, error) for x, (__, __, __, error) in zip(files, results) if error]
+
+    LOG.warning(f"Processed {len(files)} files ({cached} from the cache)")
+    for x, (__, __, __, error) in zip(files, results):
+        if not error:
+            INVENTORY.add(str(x).replace('.xml', '.md'))
+
+    if failures:
+        LOG.error(f"Failed to convert {len(failures)} of {len(files)} files:")
+        for x, error in failures:
+            LOG.error(f"    {x}: {error}")
+        sys.exit(1)
+
+    if not ARGS.no_cache:
+        _prune_md_cache({cache_key for __, __, cache_key, __ in results})
 
-    LOG.warning(f"Processed {len(files)} files")
+    _check_anchors({x: anchors for x, (__, anchors, __, error) in zip(files, results) if not error})
 
 
-def run_sphinx(src_dir):
+def _prune_md_cache(cache_keys):
+    """ Remove the entries this run didn't use, most are from an older translator version """
+    removed = 0
+    for root, dirs, files in os.walk(MD_CACHE):
+        for name in files:
+            if name.split('.')[0] not in cache_keys:
+                os.remove(os.path.join(root, name))
+                removed += 1
+    if removed:
+        LOG.warning(f"Removed {removed} unused files from {MD_CACHE}")
+
+
+def _page_key(filename):
+    """ .../<version>/docs/xml/xml/a/b.xml => (.../<version>/docs/xml/xml, 'a/b') """
+    xml_dir, docname = str(filename).split(os.sep + os.path.join("xml", "xml") + os.sep, 1)
+    return xml_dir, os.path.splitext(docname)[0].replace(os.sep, "/")
+
+
+def _check_anchors(anchors_by_file):
+    """ Look up every link to a page or anchor in the index of what each page declares,
+    and write the ones that don't resolve to UNRESOLVED_LINKS """
+    index = {_page_key(x): set(page["anchors"]) for x, page in anchors_by_file.items()}
+
+    unresolved = []
+    for x, page in sorted(anchors_by_file.items()):
+        xml_dir, docname = _page_key(x)
+        for target, fragment in page["links"]:
+            if target:
+                target = posixpath.normpath(posixpath.join(posixpath.dirname(docname), target))
+            else:
+                target = docname
+            anchors = index.get((xml_dir, target))
+            if anchors is None:
+                reason = "missing page"
+            elif fragment and fragment not in anchors:
+                reason = "missing anchor"
+            else:
+                continue
+            unresolved.append({
+                "page": os.path.relpath(str(x).replace('.xml', '.md').replace('docs/xml/xml/', '').replace(REPOS, CONTENT),
+                                        ROOT),
+                "target": target + ".md" + (f"#{fragment}" if fragment else ""),
+                "reason": reason,
+            })
+
+    os.makedirs(os.path.dirname(UNRESOLVED_LINKS), exist_ok=True)
+    with open(UNRESOLVED_LINKS, 'w') as f:
+        json.dump(unresolved, f, indent=1)
+    if unresolved:
+        LOG.warning(f"{len(unresolved)} links to missing pages or anchors, see {UNRESOLVED_LINKS}")
+
+
+def _sphinx_build(src_dir, jobs=1, quiet=False, incremental=False):
+    """ Run sphinx over one docs/source tree, returning (retval, dest) """
     src = os.path.abspath(src_dir)
     dest = os.path.join(os.path.dirname(src), 'xml')
 
-    #  Always rebuild (-a)
+    #  Always rebuild (-a), unless incremental, in which case sphinx uses the
+    #  environment pickle and doctrees it left in dest/doctrees last time.
     #  Set xmlmode tag to pull out the rest of the HTML output
-    args = ["-M", "xml", src, dest, "-a", "-t", "xmlmode"]
-    retval = sphinx_main(args)
+    args = ["-M", "xml", src, dest, "-t", "xmlmode"]
+    if not incremental:
+        args.append("-a")
+    if jobs > 1:
+        args += ["-j", str(jobs)]
+    if quiet:
+        args.append("-q")
+
+    return sphinx_main(args), dest
+
+
+def run_sphinx(src_dir, jobs=1):
+    retval, dest = _sphinx_build(src_dir, jobs)
     if retval != 0:
         sys.exit(retval)
 
     return dest
 
 
-def _search_and_replace(files, replacements):
-    for file in files:
-        if not os.path.isfile(file):
-            continue
-        LOG.debug(f"Checking {file}")
-        lines = open(file, 'r').readlines()
-        updated = False
-        count = 0
-        for line in lines:
-            for (value, new_value) in replacements:
-                if value in line:
-                    line = line.replace(value, new_value)
-                    lines[count] = line
-                    updated = True
-                    LOG.debug(f"Replaced! {value} with {new_value}")
-            count += 1
-        if updated:
-            LOG.debug(f"Rewritten file {file}")
-            open(file, 'w').writelines(lines)
-
-
-def preprocess(d):
+def _convert_rst_tree(src_dir, rst_files, sphinx_jobs, quiet, incremental):
+    """ Pre-process and build a single docs/source tree.  Runs in a worker process
+    when --jobs is given, so only returns plain values: (retval, seconds, changed)
+
+    changed is the number of xml files written, or None if the tree was skipped.
+    """
+    start = time.time()
+    preprocess(src_dir, rst_files)
+    if not incremental:
+        retval, __ = _sphinx_build(src_dir, sphinx_jobs, quiet)
+        return retval, time.time() - start, None
+
+    dest = os.path.join(os.path.dirname(os.path.abspath(src_dir)), 'xml')
+    manifest = _read_xml_manifest(dest)
+    source_hash = _hash_tree(src_dir)
+    if manifest.get("source_hash") == source_hash:
+        _write_xml_manifest(dest, source_hash, [])
+        return 0, time.time() - start, None
+
+    before = _stat_xml_files(dest)
+    retval, __ = _sphinx_build(src_dir, sphinx_jobs, quiet, incremental=True)
+    if retval != 0:
+        return retval, time.time() - start, None
+
+    after = _stat_xml_files(dest)
+    changed = sorted(relpath for relpath, st in after.items() if before.get(relpath) != st)
+    _write_xml_manifest(dest, source_hash, changed)
+    return retval, time.time() - start, len(changed)
+
+
+def _hash_tree(d):
+    """ A single hash of the relative paths and content of every file under d """
+    sha1 = hashlib.sha1()
+    for root, dirs, files in os.walk(d):
+        dirs.sort()
+        for name in sorted(files):
+            pathname = os.path.join(root, name)
+            sha1.update(os.path.relpath(pathname, d).encode())
+            sha1.update(_hash_file(pathname).encode())
+    return sha1.hexdigest()
+
+
+def _stat_xml_files(dest):
+    """ { relpath: (mtime, size) } for the xml files of a sphinx build, relative to dest/xml """
+    xml_dir = os.path.join(dest, 'xml')
+    result = {}
+    for pathname in Path(xml_dir).rglob('*.xml'):
+        st = pathname.stat()
+        result[os.path.relpath(pathname, xml_dir)] = (st.st_mtime_ns, st.st_size)
+    return result
+
+
+def _read_xml_manifest(dest):
+    pathname = os.path.join(dest, XML_MANIFEST)
+    if not os.path.exists(pathname):
+        return {}
+    with open(pathname, 'r') as f:
+        return json.load(f)
+
+
+def _write_xml_manifest(dest, source_hash, changed):
+    """ Record the source hash this build came from, and which xml files (relative
+    to dest/xml) it wrote, so later stages only need to look at those. """
+    os.makedirs(dest, exist_ok=True)
+    with open(os.path.join(dest, XML_MANIFEST), 'w') as f:
+        json.dump({"source_hash": source_hash, "changed": changed}, f, indent=2)
+
+
+def preprocess(d, files):
     LOG.debug(f"Pre-processing {d}")
     replacements = [('.. raw:: html', '.. raw:: xml'), ('.. only:: html', '.. only:: xml')]
-    files = [x for x in Path(d).rglob('*.rst')]
-    _search_and_replace(files, replacements)
+    search_and_replace(files, replacements)
 
 
-def _postprocess_xml_files(d):
+def _postprocess_xml_files(d, files):
     LOG.debug(f"Post-processing {d}")
     # Also matches: webkitallowfullscreen and mozallowfullscreen
     replacements = [
@@ -1270,8 +1796,7 @@ def _postprocess_xml_files(d):
         ('&nbsp;', ' '),
         ('<br>', '')
     ]
-    files = [x for x in Path(d).rglob('*.xml')]
-    _search_and_replace(files, replacements)
+    search_and_replace(files, replacements)
 
     #  Get rid of all the unnecessary leading whitespace in XML formatting except for code blocks
     for file in files:
@@ -1297,17 +1822,87 @@ def _postprocess_xml_files(d):
 
 def convert_rst_to_xml():
     LOG.warning("Converting all rst => xml using sphinx")
-    dirs = [x for x in Path(REPOS).rglob('docs/source')]
-    for d in dirs:
-        LOG.warning(f"Converting {d}")
-        preprocess(d)
-        run_sphinx(d)
+    dirs = INVENTORY.source_dirs()
+
+    if ARGS.jobs > 1:
+        _convert_rst_to_xml_in_parallel(dirs)
+    else:
+        for d in dirs:
+            LOG.warning(f"Converting {d}")
+            retval, seconds, changed = _convert_rst_tree(d, _rst_files(d), ARGS.sphinx_jobs, False, ARGS.incremental)
+            if retval != 0:
+                LOG.error(f"Failed to convert {d} (sphinx returned {retval})")
+                sys.exit(retval)
+            _log_converted(d, seconds, changed)
+
+    # Pick up the xml that sphinx just wrote
+    for d in INVENTORY.xml_dirs():
+        INVENTORY.rescan(d)
+
+
+def _rst_files(src_dir):
+    return INVENTORY.files(RST, *INVENTORY.key_for(src_dir))
+
+
+def _log_converted(d, seconds, changed):
+    if not ARGS.incremental:
+        LOG.warning(f"Converted {d} in {seconds:.1f}s")
+    elif changed is None:
+        LOG.warning(f"Unchanged {d}, skipped")
+    else:
+        LOG.warning(f"Converted {d} in {seconds:.1f}s ({changed} xml files written)")
+
+
+def _convert_rst_to_xml_in_parallel(dirs):
+    """  One sphinx build per docs/source tree, ARGS.jobs at a time.
+
+    On the first failure, any builds that haven't started yet are cancelled,
+    the ones already running are allowed to finish, and then we exit.
+    """
+    LOG.warning(f"Converting {len(dirs)} source trees using {ARGS.jobs} processes")
+    start = time.time()
+    failed = []
+
+    with ProcessPoolExecutor(max_workers=ARGS.jobs) as executor:
+        futures = {executor.submit(_convert_rst_tree, d, _rst_files(d), ARGS.sphinx_jobs, True, ARGS.incremental): d for d in dirs}
+        for future in as_completed(futures):
+            d = futures[future]
+            if future.cancelled():
+                continue
+            try:
+                retval, seconds, changed = future.result()
+            except Exception as e:
+                LOG.error(f"Failed to convert {d}: {e}")
+                retval, seconds = 1, 0
+            if retval == 0:
+                _log_converted(d, seconds, changed)
+                continue
+
+            LOG.error(f"Failed to convert {d} (sphinx returned {retval}) after {seconds:.1f}s")
+            if not failed:
+                for f in futures:
+                    f.cancel()
+            failed.append(d)
+
+    if failed:
+        LOG.error(f"{len(failed)} of {len(dirs)} source trees failed to convert:")
+        for d in failed:
+            LOG.error(f"    {d}")
+        sys.exit(1)
+
+    LOG.warning(f"Converted {len(dirs)} source trees in {time.time() - start:.1f}s")
 
 
 def postprocess_xml():
     LOG.warning("Post-processing all XML")
-    for d in [x for x in Path(REPOS).rglob('xml/xml')]:
-        _postprocess_xml_files(d)
+    for d in INVENTORY.xml_dirs():
+        if ARGS.incremental:
+            # Only the files sphinx just wrote - the rest have already been post-processed,
+            # and post-processing isn't idempotent.
+            manifest = _read_xml_manifest(os.path.dirname(d))
+            _postprocess_xml_files(d, [os.path.join(d, relpath) for relpath in manifest.get("changed", [])])
+        else:
+            _postprocess_xml_files(d, INVENTORY.files(XML, *INVENTORY.key_for(d)))
     LOG.warning("Post-processing all XML finished")
 
 
@@ -1316,6 +1911,7 @@ def _remove_junk_that_breaks_hugo():
     for f in ["source/resources/nodefull.md", "xml/xml/resources/nodefull.md"]:
         pathname = os.path.join(root, f)
         if os.path.exists(pathname): os.unlink(pathname)
+        INVENTORY.remove(pathname)
 
 
 def copy_to_content(cms):
@@ -1323,8 +1919,8 @@ def copy_to_content(cms):
 
     _remove_junk_that_breaks_hugo()
 
-    dirs = []
-    files = [x for x in Path(REPOS).rglob('xml/xml/**/*.md')]
+    files = INVENTORY.files(MD)
+    pairs = {}
     for src in files:
         dest = str(src).replace('docs/xml/xml/', '').replace(REPOS, CONTENT)
         src_filename = os.path.basename(src)
@@ -1341,64 +1937,70 @@ def copy_to_content(cms):
                 LOG.info(f"Copying {src} to {dest}")
                 dest = index_md  # it was 'index.rst', copying to '_index.md'
 
-        if not os.path.exists(os.path.dirname(dest)):
-            os.makedirs(os.path.dirname(dest), exist_ok=True)
-
         if dest.endswith("_index.md"):
             LOG.info(f"Copying {src} {dest}")
 
         LOG.debug(f"Copying {src} {dest}")
-        shutil.copyfile(src, dest)
-        if os.path.dirname(dest) not in dirs:
-            dirs.append(os.path.dirname(dest))
+        pairs[dest] = src
 
-    LOG.warning(f"Copied {len(files)} files")
+    copier = Copier(ARGS.copy_mode, jobs=ARGS.jobs * 4)
+    copier.copy_files([(src, dest) for dest, src in pairs.items()])
+    for dest in pairs:
+        INVENTORY.add(dest)
+    LOG.warning(f"Copied {len(files)} files ({copy_summary(copier.counts)})")
 
 
 def copy_resources_to_content():
     LOG.warning("Copying all resources to content/")
 
-    for d in ['_static', 'resources']:
-        dirs = [x for x in Path(REPOS).rglob(f'docs/source/{d}')]
-        for src in dirs:
-            dest = str(src).replace(f'docs/source/{d}', d).replace(REPOS, CONTENT)
-            LOG.debug(f"Copying {src} {dest}")
-            copy_tree(src, dest)
+    pairs = []
+    for src in INVENTORY.files(RESOURCE):
+        d = src.relative_to(INVENTORY.versions[INVENTORY.key_for(src)]).parts[1]  # _static or resources
+        dest = str(src).replace(f'docs/source/{d}', d).replace(REPOS, CONTENT)
+        LOG.debug(f"Copying {src} {dest}")
+        pairs.append((src, dest))
+
+    copier = Copier(ARGS.copy_mode, preserve_times=True, jobs=ARGS.jobs * 4)
+    copier.copy_files(pairs)
+    for __, dest in pairs:
+        INVENTORY.add(dest)
 
-    LOG.warning(f"Copied resources")
+    LOG.warning(f"Copied resources ({copy_summary(copier.counts)})")
 
     _replace_duplicate_resources()
 
 
 def _get_duplicate_resources_by_hash():
-    d = {}
     exts = [".pdf", ".png", ".gif", ".jpg"]
-    for pathname in [x for x in Path(os.path.join(CONTENT, 'en')).rglob(f'**/*')]:
-        ext = os.path.splitext(pathname)[1]
-        if ext not in exts:
-            continue
-        hash = _hash_file(pathname)
-        paths = d.get(hash, [])
-        paths.append(pathname)
-        d[hash] = paths
-
-    return [paths for __, paths in d.items() if len(paths) > 1]
+    candidates = [x for x in INVENTORY.files(CONTENT_RESOURCE) if x.suffix in exts]
+    return find_duplicates(candidates, cache_pathname=RESOURCE_DIGESTS, jobs=ARGS.jobs * 4)
 
 
 def _replace_duplicate_resources():
     LOG.warning("Removing duplicate resources")
     list_of_paths = _get_duplicate_resources_by_hash()
     # All extensions (above) that are repeated in 2 or more projects
+    replacements_by_version = {}
+    consolidated_bytes = 0
     for paths in list_of_paths:
         f = [os.path.basename(path) for path in paths]
         if len(f) != len(paths):
             LOG.error("different filenames!")
 
-        _replace_duplicate_resources_in_files(paths)
+        consolidated_bytes += _consolidate_duplicate_resources(paths, replacements_by_version)
+
+    links = 0
+    for (project, this_version), replacements in replacements_by_version.items():
+        files_in_this_version = INVENTORY.files(CONTENT_MD, project, this_version)
+        __, count = search_and_replace(files_in_this_version, replacements)
+        links += count
+
+    LOG.warning(f"Consolidated {links} links to {len(list_of_paths)} resources, removing {consolidated_bytes} bytes")
 
 
-def _replace_duplicate_resources_in_files(paths):
-    #  Firstly copy the first resource path to the common folder.
+def _consolidate_duplicate_resources(paths, replacements_by_version):
+    """ Copy the first of paths to the common folder, delete them all, and record the
+    link replacements needed in each version.  Returns the number of bytes saved. """
     new_relative_resource_path = None
     image_exts = [".png", ".gif", ".jpg"]
 
@@ -1419,16 +2021,18 @@ def _replace_duplicate_resources_in_files(paths):
                 new_relative_resource_path = os.path.join("en", "pdf", filename)
             LOG.warning(f"Consolidating into one file {new_relative_resource_path}")
 
-        dest = os.path.join(ROOT, "static", new_relative_resource_path)
-        shutil.copyfile(pathname, dest)
+            dest = os.path.join(ROOT, "static", new_relative_resource_path)
+            shutil.copyfile(pathname, dest)
+            size = os.path.getsize(dest)
 
         # don't fully match trailing parenthesis as we can have:
         # [text](the/old/link/text.md "some alt text at the end")
-        replacements = [( f"({old_relative_resource_path}", f"(/{new_relative_resource_path}")]
-        this_version = os.path.join(CONTENT, "en", dirs[0], dirs[1], dirs[2])
-        files_in_this_version = [x for x in Path(this_version).rglob(f'**/*') if str(x).endswith(".md")]
-        _search_and_replace(files_in_this_version, replacements)
+        replacements_by_version.setdefault((dirs[1], dirs[2]), []).append(
+            (f"({old_relative_resource_path}", f"(/{new_relative_resource_path}"))
         os.unlink(pathname)
+        INVENTORY.remove(pathname)
+
+    return size * (len(paths) - 1)
 
 
 def _hash_file(pathname):
@@ -1460,11 +2064,29 @@ def create_missing_pages():
         if not os.path.exists(index_md):
             LOG.warning(f"Writing empty: {index_md}")
             open(index_md, 'w').close()
+            INVENTORY.add(index_md)
+
+
 
+def _log_inventory_changes():
+    previous = Inventory.load(INVENTORY_FILE)
+    LOG.warning(f"Found {len(INVENTORY.stats)} files in {len(INVENTORY.versions)} versions")
+    if previous:
+        added, removed, changed = INVENTORY.diff(previous)
+        LOG.warning(f"Since the last run: {len(added)} files added, {len(removed)} removed, {len(changed)} changed")
+
+
+def _cms_for(name):
+    if name == 'markdown':
+        return Markdown()  #  Generates hugo-shortcode free markdown - uses divs instead
+    elif name == "gatsby":
+        return Gatsby()  # which simply adds react tags <Tab> <Tabs> etc.
+    else:
+        return Hugo()
 
 
 def main():
-    global ARGS, MENU_FILES, INCLUDES
+    global ARGS, MENU_FILES, INCLUDES, INVENTORY
 
     desc = "Convert rst files to md using sphinx"
     parser = argparse.ArgumentParser(description=desc)
@@ -1473,6 +2095,13 @@ def main():
     parser.add_argument("--full-conversion", "-f", help="full conversion of rst, default skip rst conversion for speed", default=False, action='store_true')
     parser.add_argument("--cms", "-c", help="generate (commonmark) markdown for cms", default='hugo', choices=['gatsby', 'markdown', 'hugo'])
     parser.add_argument("--skip-resources", help="skip copying resources", default=False, action='store_true')
+    parser.add_argument("--copy-mode", help="how to copy md and resources to content/.  All but 'copy' leave files that are already identical untouched", default='skip-identical', choices=COPY_MODES)
+    parser.add_argument("--jobs", "-j", help="number of processes to use to convert rst => xml (one source tree each) and xml => md", default=1, type=int)
+    parser.add_argument("--sphinx-jobs", help="passed to sphinx as -j for each source tree", default=1, type=int)
+    parser.add_argument("--split-menus", help=f"also write each version's menus to its own hugo config file in {MENUS_DIR}, to build with hugo --configDir {SPLIT_CONFIG_DIR}", default=False, action='store_true')
+    parser.add_argument("--no-cache", help=f"always translate xml => md and build every version's menus, rather than reusing unchanged ones from {MD_CACHE} and {MENUS_CACHE}", default=False, action='store_true')
+    parser.add_argument("--stream-min-size", help="translate xml files of at least this many bytes with the streaming translator, which keeps memory use flat on very large pages", default=None, type=int)
+    parser.add_argument("--incremental", "-i", help="with --full-conversion, only rebuild source trees that changed since the last run, and only the pages in them that sphinx thinks are out of date", default=False, action='store_true')
 
     ARGS = parser.parse_args()
 
@@ -1482,24 +2111,31 @@ def main():
     LOG.warning(f"You also need to then git checkout the branch you want.")
     LOG.warning(f"There is a script that does this - get_repos.sh")
 
+    INVENTORY = Inventory(REPOS, CONTENT).scan()
+    _log_inventory_changes()
+
     if ARGS.full_conversion:
         convert_rst_to_xml()
         postprocess_xml()
     else:
         LOG.warning("Skipping rst-to-xml")
 
-    if ARGS.cms == 'markdown':
-        cms = Markdown()  #  Generates hugo-shortcode free markdown - uses divs instead
-    elif ARGS.cms == "gatsby":
-        cms = Gatsby()  # which simply adds react tags <Tab> <Tabs> etc.
-    else:
-        cms = Hugo()
+    cms = _cms_for(ARGS.cms)
 
-    menus_to_be_written_to_config, MENU_FILES = parse_rst_files_for_menus()
-    INCLUDES = parse_literal_includes()
+    rst_index = RstIndex(RST_INDEX)
+    (menus_to_be_written_to_config, MENU_FILES), parsed = parse_rst_files_for_menus_by_version(
+        INVENTORY.files(RST), rst_index, None if ARGS.no_cache else MENUS_CACHE)
+    LOG.warning(f"Built menus for {parsed} changed versions")
+    INCLUDES = parse_literal_includes(INVENTORY.files(RST), rst_index)
+    rst_index.save()
+    LOG.warning(f"Parsed {rst_index.parsed} changed rst files")
 
-    menus = os.path.join(ROOT, "config/_default/menus/menus.en.toml")
-    open(menus, 'w').write(toml.dumps(menus_to_be_written_to_config))
+    # Only if it changed, hugo serve rebuilds the whole site when the menus change
+    if write_if_changed(MENUS_TOML, toml.dumps(menus_to_be_written_to_config)):
+        LOG.warning(f"Wrote {MENUS_TOML}")
+    if ARGS.split_menus:
+        written = write_split_menus(menus_to_be_written_to_config, MENU_FILES)
+        LOG.warning(f"Wrote {written} split menu files to {MENUS_DIR}, build with hugo --configDir {SPLIT_CONFIG_DIR}")
 
     convert_all_xml_to_md(cms)
 
@@ -1513,6 +2149,8 @@ def main():
 
     create_missing_pages()
 
+    INVENTORY.save(INVENTORY_FILE)
+
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+
+import errno
+import filecmp
+import logging
+import os
+import shutil
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+LOG = logging.getLogger(__name__)
+
+COPY_MODES = ['copy', 'skip-identical', 'hardlink', 'reflink']
+
+FICLONE = 0x40049409  # linux ioctl to share the source's extents (btrfs, xfs, ...)
+
+# Errors meaning "this filesystem can't do that", rather than anything being wrong
+_UNSUPPORTED = (errno.EXDEV, errno.EPERM, errno.EOPNOTSUPP, errno.ENOTTY, errno.EINVAL, errno.EMLINK)
+
+
+class Copier:
+    """ Copies files into place with one of COPY_MODES:
+
+        copy            always write dest (the old behaviour)
+        skip-identical  copy, unless dest already has the same content
+        hardlink        link dest to src, falling back to a copy across filesystems
+        reflink         clone src's extents where the filesystem can, otherwise copy
+
+    Apart from 'copy', dest is left alone if it is already identical to src, so its
+    mtime doesn't change.  New files are written alongside and renamed into place,
+    which also means nothing ever writes through a hardlink into src.
+    """
+
+    def __init__(self, mode='skip-identical', preserve_times=False, jobs=None):
+        if mode not in COPY_MODES:
+            raise ValueError(f"Unknown copy mode {mode}, expected one of {COPY_MODES}")
+        self.mode = mode
+        self.preserve_times = preserve_times
+        self.jobs = jobs
+        self.can_link = True
+        self.can_clone = True
+        self.counts = {'copied': 0, 'linked': 0, 'cloned': 0, 'unchanged': 0}
+
+    def _is_unchanged(self, src, dest):
+        try:
+            if os.path.samefile(src, dest):
+                return True
+            return self.mode != 'hardlink' and filecmp.cmp(src, dest, shallow=True)
+        except FileNotFoundError:
+            return False
+
+    def _link(self, src, tmp_pathname):
+        os.unlink(tmp_pathname)
+        os.link(src, tmp_pathname)
+        return 'linked'
+
+    def _clone(self, src, tmp_pathname):
+        import fcntl
+        with open(src, 'rb') as s, open(tmp_pathname, 'wb') as d:
+            fcntl.ioctl(d.fileno(), FICLONE, s.fileno())
+        return 'cloned'
+
+    def _copy(self, src, tmp_pathname):
+        shutil.copyfile(src, tmp_pathname)
+        shutil.copymode(src, tmp_pathname)
+        if self.preserve_times:
+            shutil.copystat(src, tmp_pathname)
+        return 'copied'
+
+    def _write(self, src, tmp_pathname):
+        if self.mode == 'hardlink' and self.can_link:
+            try:
+                return self._link(src, tmp_pathname)
+            except OSError as e:
+                if e.errno not in _UNSUPPORTED:
+                    raise
+                if self.can_link:
+                    self.can_link = False
+                    LOG.warning(f"Can't hardlink {src} ({e.strerror}), copying instead")
+        elif self.mode == 'reflink' and self.can_clone:
+            try:
+                return self._clone(src, tmp_pathname)
+            except (OSError, ImportError) as e:
+                if isinstance(e, OSError) and e.errno not in _UNSUPPORTED:
+                    raise
+                if self.can_clone:
+                    self.can_clone = False
+                    LOG.warning(f"Can't reflink {src} ({e}), copying instead")
+
+        return self._copy(src, tmp_pathname)
+
+    def copy_file(self, src, dest):
+        """ Returns what was done: copied, linked, cloned or unchanged """
+        if self.mode != 'copy' and self._is_unchanged(src, dest):
+            return 'unchanged'
+
+        dirname = os.path.dirname(dest)
+        os.makedirs(dirname, exist_ok=True)
+        fd, tmp_pathname = tempfile.mkstemp(dir=dirname, prefix=".tmp-")
+        os.close(fd)
+        try:
+            result = self._write(src, tmp_pathname)
+            os.replace(tmp_pathname, dest)
+        except BaseException:
+            if os.path.lexists(tmp_pathname):
+                os.unlink(tmp_pathname)
+            raise
+        return result
+
+    def copy_files(self, pairs):
+        """ Copy each (src, dest) using a thread pool.  Returns counts of what was done. """
+        with ThreadPoolExecutor(max_workers=self.jobs) as executor:
+            for result in executor.map(lambda pair: self.copy_file(*pair), pairs):
+                self.counts[result] += 1
+        return self.counts
+
+
+def summary(counts):
+    return ", ".join(f"{n} {what}" for what, n in counts.items() if n)
@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+
+import json
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import xxhash
+
+    def _new_digest():
+        return xxhash.xxh3_128()
+
+    DIGEST = "xxh3_128"
+except ImportError:
+    import hashlib
+
+    def _new_digest():
+        return hashlib.blake2b(digest_size=16)
+
+    DIGEST = "blake2b-128"
+
+LOG = logging.getLogger(__name__)
+
+BLOCK_SIZE = 65536
+
+
+def _partial_hash(pathname, size):
+    """ Hash of the first and last blocks.  Files of up to two blocks are read whole,
+    so for those this is already the full hash. """
+    digest = _new_digest()
+    with open(pathname, 'rb') as f:
+        digest.update(f.read(BLOCK_SIZE))
+        if size > BLOCK_SIZE:
+            f.seek(max(BLOCK_SIZE, size - BLOCK_SIZE))
+            digest.update(f.read(BLOCK_SIZE))
+    return digest.hexdigest()
+
+
+def _full_hash(pathname):
+    digest = _new_digest()
+    with open(pathname, 'rb') as f:
+        while True:
+            data = f.read(BLOCK_SIZE * 16)
+            if not data:
+                break
+            digest.update(data)
+    return digest.hexdigest()
+
+
+def _collisions(groups):
+    return [paths for paths in groups.values() if len(paths) > 1]
+
+
+class DigestCache:
+    """ (path, mtime, size) => digests, saved as json between runs """
+
+    def __init__(self, pathname=None):
+        self.pathname = pathname
+        self.entries = {}
+        self.seen = {}
+        if pathname and os.path.exists(pathname):
+            try:
+                with open(pathname, 'r') as f:
+                    data = json.load(f)
+                if data.get("digest") == DIGEST:
+                    self.entries = data["files"]
+            except (ValueError, KeyError, OSError) as e:
+                LOG.warning(f"Ignoring unreadable digest cache {pathname}: {e}")
+
+    def lookup(self, pathname, stat):
+        """ Returns the cached entry, or a fresh one if the file has changed """
+        key = str(pathname)
+        entry = self.entries.get(key)
+        if not entry or entry["mtime"] != stat.st_mtime_ns or entry["size"] != stat.st_size:
+            entry = {"mtime": stat.st_mtime_ns, "size": stat.st_size}
+        self.seen[key] = entry
+        return entry
+
+    def save(self):
+        """ Only keeps the files seen in this run """
+        if not self.pathname:
+            return
+        os.makedirs(os.path.dirname(self.pathname), exist_ok=True)
+        tmp_pathname = self.pathname + ".tmp"
+        with open(tmp_pathname, 'w') as f:
+            json.dump({"digest": DIGEST, "files": self.seen}, f)
+        os.replace(tmp_pathname, self.pathname)
+
+
+def find_duplicates(pathnames, cache_pathname=None, jobs=None):
+    """ Returns lists of files with identical content, in the order given.
+
+    Candidates are grouped by size, then by a hash of their first and last blocks, and
+    only files that still collide get a full hash.  Digests are cached against
+    (path, mtime, size), so unchanged files are never read again.
+    """
+    cache = DigestCache(cache_pathname)
+    order = {}
+    by_size = {}
+    entries = {}
+    for pathname in pathnames:
+        order[pathname] = len(order)
+        stat = os.stat(pathname)
+        entries[pathname] = cache.lookup(pathname, stat)
+        by_size.setdefault(stat.st_size, []).append(pathname)
+
+    def hash_all(key, func, paths):
+        todo = [path for path in paths if key not in entries[path]]
+        for path, digest in zip(todo, executor.map(func, todo)):
+            entries[path][key] = digest
+
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        candidates = [path for paths in _collisions(by_size) for path in paths]
+        hash_all("partial", lambda path: _partial_hash(path, entries[path]["size"]), candidates)
+
+        by_partial = {}
+        for path in candidates:
+            by_partial.setdefault((entries[path]["size"], entries[path]["partial"]), []).append(path)
+
+        candidates = [path for paths in _collisions(by_partial) for path in paths
+                      if entries[path]["size"] > 2 * BLOCK_SIZE]
+        hash_all("full", _full_hash, candidates)
+
+    by_content = {}
+    for path in sorted((path for paths in _collisions(by_partial) for path in paths), key=order.get):
+        entry = entries[path]
+        by_content.setdefault((entry["size"], entry.get("full", entry["partial"])), []).append(path)
+
+    cache.save()
+    LOG.debug(f"Hashed {len(order)} candidates with {DIGEST}")
+    return sorted(_collisions(by_content), key=lambda paths: order[paths[0]])
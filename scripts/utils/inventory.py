@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+
+import json
+import logging
+import os
+from pathlib import Path
+
+LOG = logging.getLogger(__name__)
+
+#  Roles of files under repos/<lang>/docs/<project>/<version>/docs/
+RST = "rst"                   # source/**/*.rst
+RESOURCE = "resource"         # source/_static/** and source/resources/**
+XML = "xml"                   # xml/xml/**/*.xml, written by sphinx
+MD = "md"                     # xml/xml/**/*.md, written by the xml => md conversion
+
+#  Roles of files under content/
+CONTENT_MD = "content_md"
+CONTENT_RESOURCE = "content_resource"
+
+RESOURCE_DIRS = ['_static', 'resources']
+
+
+def _walk(top):
+    """ Yields (pathname, stat) for every file under top, without following symlinked dirs """
+    stack = [top]
+    while stack:
+        try:
+            it = os.scandir(stack.pop())
+        except FileNotFoundError:
+            continue
+        with it:
+            for entry in it:
+                if entry.is_dir(follow_symlinks=False):
+                    if entry.name != '.git':
+                        stack.append(entry.path)
+                elif entry.is_file():
+                    yield entry.path, entry.stat()
+
+
+def _subdirs(d):
+    try:
+        return sorted(entry.path for entry in os.scandir(d) if entry.is_dir())
+    except FileNotFoundError:
+        return []
+
+
+def _project_and_version(parts):
+    """ (project, version) from path components after the first 'docs', or (None, None) """
+    try:
+        i = parts.index('docs')
+        return parts[i + 1], parts[i + 2]
+    except (ValueError, IndexError):
+        return None, None
+
+
+class Inventory:
+    """ Every file the pipeline works on, found in one walk of repos/ and content/.
+
+    Files are classified by role (the constants above) and by (project, version),
+    e.g. ('corda-os', '4.4').  Stages that create or delete files update it with
+    add(), remove() and rescan(), so later stages never need to glob again.  It can be
+    saved, and the next run can diff against it to see what changed in between.
+    """
+
+    def __init__(self, repos, content):
+        self.repos = str(repos)
+        self.content = str(content)
+        self.stats = {}  # pathname => (mtime_ns, size)
+        self.roles = {}  # role => { (project, version): { pathname: None } }, dicts as ordered sets
+        self.versions = {}  # (project, version) => repos/<lang>/docs/<project>/<version>/docs
+
+    def _roles_for(self, pathname):
+        if pathname.startswith(self.content + os.sep):
+            return [CONTENT_MD if pathname.endswith('.md') else CONTENT_RESOURCE], self.key_for(pathname)
+
+        parts = pathname[len(self.repos) + 1:].split(os.sep)
+        project, version = _project_and_version(parts)
+        rest = parts[parts.index('docs') + 3:] if project else []
+        roles = []
+        if rest[:2] == ['docs', 'source']:
+            if pathname.endswith('.rst'):
+                roles.append(RST)
+            if len(rest) > 3 and rest[2] in RESOURCE_DIRS:
+                roles.append(RESOURCE)
+        elif rest[:3] == ['docs', 'xml', 'xml']:
+            if pathname.endswith('.xml'):
+                roles.append(XML)
+            elif pathname.endswith('.md'):
+                roles.append(MD)
+        return roles, (project, version)
+
+    def add(self, pathname, stat=None):
+        pathname = str(pathname)
+        if stat is None:
+            stat = os.stat(pathname)
+        self._add(pathname, (stat.st_mtime_ns, stat.st_size))
+
+    def _add(self, pathname, st):
+        roles, key = self._roles_for(pathname)
+        if not roles:
+            return
+        self.stats[pathname] = st
+        for role in roles:
+            self.roles.setdefault(role, {}).setdefault(key, {})[pathname] = None
+
+    def remove(self, pathname):
+        pathname = str(pathname)
+        if self.stats.pop(pathname, None) is None:
+            return
+        roles, key = self._roles_for(pathname)
+        for role in roles:
+            self.roles[role][key].pop(pathname, None)
+
+    def _add_tree(self, top):
+        for pathname, stat in _walk(top):
+            self.add(pathname, stat)
+
+    def rescan(self, top):
+        """ Forget everything under top, then walk it again """
+        top = str(top)
+        prefix = top + os.sep
+        for pathname in [p for p in self.stats if p.startswith(prefix)]:
+            self.remove(pathname)
+        self._add_tree(top)
+
+    def scan(self):
+        """ Walks only the docs/source and docs/xml/xml trees of each version in repos/ -
+        they're git clones, so there is a lot else in there - and all of content/ """
+        for lang in _subdirs(self.repos):
+            for project in _subdirs(os.path.join(lang, 'docs')):
+                for version_dir in _subdirs(project):
+                    docs = os.path.join(version_dir, 'docs')
+                    if not os.path.isdir(os.path.join(docs, 'source')):
+                        continue
+                    self.versions[self.key_for(docs)] = docs
+                    self._add_tree(os.path.join(docs, 'source'))
+                    self._add_tree(os.path.join(docs, 'xml', 'xml'))
+        self._add_tree(self.content)
+        return self
+
+    def key_for(self, pathname):
+        """ (project, version) of a path in repos/ or content/ """
+        pathname = str(pathname)
+        top = self.content if pathname.startswith(self.content + os.sep) else self.repos
+        return _project_and_version(pathname[len(top) + 1:].split(os.sep))
+
+    def files(self, role, project=None, version=None):
+        """ Paths with this role, optionally just for one project and/or version """
+        return [Path(pathname) for (p, v), pathnames in self.roles.get(role, {}).items()
+                if project in (None, p) and version in (None, v) for pathname in pathnames]
+
+    def source_dirs(self):
+        return [Path(docs, 'source') for docs in self.versions.values()]
+
+    def xml_dirs(self):
+        return [Path(docs, 'xml', 'xml') for docs in self.versions.values()]
+
+    def save(self, pathname):
+        """ Stats every file again first, as stages rewrite files in place """
+        for file in list(self.stats):
+            try:
+                st = os.stat(file)
+                self.stats[file] = (st.st_mtime_ns, st.st_size)
+            except FileNotFoundError:
+                self.remove(file)
+
+        os.makedirs(os.path.dirname(pathname), exist_ok=True)
+        tmp_pathname = pathname + ".tmp"
+        with open(tmp_pathname, 'w') as f:
+            json.dump({"repos": self.repos, "content": self.content, "files": self.stats}, f)
+        os.replace(tmp_pathname, pathname)
+
+    @classmethod
+    def load(cls, pathname):
+        """ A previously saved inventory, or None """
+        if not os.path.exists(pathname):
+            return None
+        try:
+            with open(pathname, 'r') as f:
+                data = json.load(f)
+            inventory = cls(data["repos"], data["content"])
+            for file, st in data["files"].items():
+                inventory._add(file, tuple(st))
+        except (ValueError, KeyError, TypeError) as e:
+            LOG.warning(f"Ignoring unreadable inventory {pathname}: {e}")
+            return None
+        return inventory
+
+    def diff(self, previous):
+        """ Returns (added, removed, changed) pathnames since a previous inventory """
+        added = [p for p in self.stats if p not in previous.stats]
+        removed = [p for p in previous.stats if p not in self.stats]
+        changed = [p for p, st in self.stats.items() if p in previous.stats and previous.stats[p] != st]
+        return added, removed, changed
@@ -1,5 +1,6 @@
 #!/usr/bin/env python3
 
+import functools
 import logging
 import os
 import shutil
@@ -12,7 +13,13 @@ import toml
 import yaml
 import hashlib
 from collections import namedtuple
-from utils.parse_menus import version, version_for_config, parse_rst, repo_and_version
+try:
+    from utils.parse_menus import version, version_for_config, parse_rst, repo_and_version
+    from utils.rst_index import RstIndex
+except ImportError:
+    # Run as a script, python3 utils/parse_literal_includes.py
+    from parse_menus import version, version_for_config, parse_rst, repo_and_version
+    from rst_index import RstIndex
 
 THIS_DIR = os.path.dirname(os.path.realpath(__file__))
 ROOT = os.path.dirname(os.path.dirname(THIS_DIR))
@@ -23,6 +30,9 @@ REPOS_ROOT = os.path.join(REPOS, "en/docs")  # don't rely on this.
 LOG = logging.getLogger(__name__)
 ARGS = None
 
+# At module level, so it's only created once and can be pickled for the --jobs workers
+LiteralInclude = namedtuple("LiteralInclude", ['src', 'url', 'raw_url', 'start_after', 'end_before'])
+
 
 def _setup_logging():
     # LOG.setLevel(logging.WARN)
@@ -92,14 +102,34 @@ def _github_raw_path(repo, version, literalinclude_relpath):
     return f"https://raw.githubusercontent.com/corda/{_github_repo(repo)}/{_github_version(repo, version)}/{literalinclude_relpath}"
 
 
-def _find_line_number(lines, value):
-    line_number = 1
-    for line in lines:
-        if line.strip().endswith(value):
-            break
-        line_number += 1
+class _SourceFile:
+    """ The lines of a source file, and the line numbers of the markers looked up so far """
+
+    def __init__(self, pathname):
+        with open(pathname, 'r') as f:
+            self.lines = [line.strip() for line in f]
+        self.line_numbers = {}
+
+    def find_line_numbers(self, *values):
+        """ For each value, the number of the first line ending with it (or one past the
+        last line if none do).  Markers not already known are found in a single scan. """
+        todo = {value for value in values if value not in self.line_numbers}
+        if todo:
+            for line_number, line in enumerate(self.lines, 1):
+                for value in [value for value in todo if line.endswith(value)]:
+                    self.line_numbers[value] = line_number
+                    todo.remove(value)
+                if not todo:
+                    break
+            for value in todo:
+                self.line_numbers[value] = len(self.lines) + 1
 
-    return line_number
+        return [self.line_numbers[value] for value in values]
+
+
+@functools.lru_cache(maxsize=256)
+def _source_file(pathname, mtime_ns):
+    return _SourceFile(pathname)
 
 
 def _github_path(repo, version, literalinclude_relpath, args):
@@ -110,29 +140,28 @@ def _github_path(repo, version, literalinclude_relpath, args):
         LOG.error(f"Path does not exist, return URL anyway: {pathname}")
         return url
 
-    lines = open(pathname, 'r').readlines()
+    source_file = _source_file(pathname, os.stat(pathname).st_mtime_ns)
 
     url_suffix = ""
     if "start-after" in args:
-        num = _find_line_number(lines, args['start-after']) + 1
-        url_suffix += f"#L{num}"
+        markers = [args['start-after']] + ([args['end-before']] if "end-before" in args else [])
+        line_numbers = source_file.find_line_numbers(*markers)
+        url_suffix += f"#L{line_numbers[0] + 1}"
         if "end-before" in args:
-            num = _find_line_number(lines, args['end-before']) - 1
-            url_suffix += f"-L{num}"
+            url_suffix += f"-L{line_numbers[1] - 1}"
 
     return url + url_suffix
 
 
-def parse_literal_includes_in_file(filename):
+def parse_literal_includes_in_file(filename, directives=None):
     """ Returns a namedtuple """
     relpath = md_relpath(filename)
     repo, version = repo_and_version(filename)
 
-    version_key = version_for_config(filename)
-
-    directives = parse_rst(filename)
+    version_key = sys.intern(version_for_config(filename))
 
-    LiteralInclude = namedtuple("LiteralInclude", ['src', 'url', 'raw_url', 'start_after', 'end_before'])
+    if directives is None:
+        directives = parse_rst(filename)
 
     literal_includes = []
     for directive in directives:
@@ -159,12 +188,16 @@ def github_shortcode_for(index, literal_includes):
     return github_shortcode(literal_includes[index])
 
 
-def parse_literal_includes():
-    files = [x for x in Path(REPOS).rglob('docs/source/**/*.rst')]
+def parse_literal_includes(files=None, rst_index=None):
+    """ { version: { md relpath: [literal includes] } } for the given rst files, or all of them """
+    if files is None:
+        files = [x for x in Path(REPOS).rglob('docs/source/**/*.rst')]
+    if rst_index is None:
+        rst_index = RstIndex()
 
     lookup = {}
     for file in files:
-        version_key, md_relpath, literal_includes = parse_literal_includes_in_file(file)
+        version_key, md_relpath, literal_includes = parse_literal_includes_in_file(file, rst_index.directives(file))
         files_dict = lookup.get(version_key, {})
         files_dict[md_relpath] = literal_includes
         lookup[version_key] = files_dict
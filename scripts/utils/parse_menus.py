@@ -1,63 +1,57 @@
 #!/usr/bin/env python3
 
 import argparse
+import csv
+import hashlib
+import json
 import logging
+import io
 import os
 import re
-from collections import Set
+import shutil
+import sys
 from pathlib import Path
 
 import toml
 import yaml
 
+try:
+    from utils.rst_index import RstIndex, parse_directives
+except ImportError:
+    # Run as a script, python3 utils/parse_menus.py
+    from rst_index import RstIndex, parse_directives
+
 THIS_DIR = os.path.dirname(os.path.realpath(__file__))
 ROOT = os.path.dirname(os.path.dirname(THIS_DIR))
 REPOS = os.path.join(ROOT, "repos")
 CONTENT = os.path.join(ROOT, "content")
 REPOS_ROOT = os.path.join(REPOS, "en/docs")  # don't rely on this.
+MENUS_TOML = os.path.join(ROOT, "config", "_default", "menus", "menus.en.toml")
+# hugo merges every config file under config/_default/, so the split menus go in a config dir of their own, for
+# hugo --configDir, rather than next to menus.en.toml
+SPLIT_CONFIG_DIR = os.path.join(ROOT, ".cache", "split-menus")
+MENUS_DIR = os.path.join(SPLIT_CONFIG_DIR, "_default", "menus")
+# Not a config file extension, so hugo leaves it alone
+MENUS_INDEX = "index.csv"
 
 LOG = logging.getLogger(__name__)
 ARGS = None
 
 
-class Directive:
-    def __init__(self):
-        self.args = {}
-        self.name = None
-        self.value = None
-        self.inner = []
-
-    def parse(self, line):
-        # The opening directive
-        if line.strip().startswith(".."):
-            parts = line.split("::")
-            self.name = parts[0].replace("..", "").strip()
-            if len(parts) > 1:
-                self.value = parts[1].strip()
-            return
-
-        # A parameter
-        if line.strip().startswith(":"):
-            matches = re.match(r":(.*):\s+(.*)", line.strip())
-            if matches:
-                self.args[matches.group(1)] = matches.group(2)
-            else:
-                matches = re.match(r":(.*):", line.strip())
-                if matches:
-                    self.args[matches.group(1)] = "true"
-
-            return
-
-        # Content
-        self.inner.append(line.strip())
+def _intern(s):
+    return sys.intern(s) if s is not None else None
 
 
 class MenuEntry:
+    # There's one of these per page and caption of every version, so no __dict__, and the menu ids and
+    # identifiers (which become the parents) are interned so each is only held once.
+    __slots__ = ('menu_id', 'identifier', 'name', 'parent', 'weight', 'md_relpath')
+
     def __init__(self, menu_id, identifier, name, parent, weight):
-        self.menu_id = menu_id
-        self.identifier = identifier
+        self.menu_id = _intern(menu_id)
+        self.identifier = _intern(identifier)
         self.name = name
-        self.parent = parent
+        self.parent = _intern(parent)
         self.weight = weight
         self.md_relpath = None
 
@@ -84,6 +78,8 @@ class Menus:
     def __init__(self):
         self.menu_entries_by_identifier = {}
         self.identifier_by_relpath = {}
+        # menu_id => { identifier: menu_entry }, in the order they were first added
+        self.menu_entries_by_menu_id = {}
 
     def add(self, menu_entry):
         """ Adds, or overwrites """
@@ -95,7 +91,12 @@ class Menus:
 
         if menu_entry.md_relpath:
             self.identifier_by_relpath[menu_entry.md_relpath] = menu_entry.identifier
+
+        previous = self.menu_entries_by_identifier.get(menu_entry.identifier, None)
+        if previous is not None and previous.menu_id != menu_entry.menu_id:
+            del self.menu_entries_by_menu_id[previous.menu_id][menu_entry.identifier]
         self.menu_entries_by_identifier[menu_entry.identifier] = menu_entry
+        self.menu_entries_by_menu_id.setdefault(menu_entry.menu_id, {})[menu_entry.identifier] = menu_entry
 
     def get_by_identifier(self, identifier):
         return self.menu_entries_by_identifier.get(identifier, None)
@@ -109,35 +110,43 @@ class Menus:
             return None
         return self.menu_entries_by_identifier.get(identifier, None)
 
-    def get_menu_entries_for_config(self):
-        """ literally just call toml.dumps() on this."""
-        menu_entries_by_menu_id = {}
-        for k in sorted(self.menu_entries_by_identifier.keys()):
+    def menu_ids(self):
+        """ corda-os-4-4, cenm-1-0 etc. """
+        return [menu_id for menu_id, entries in self.menu_entries_by_menu_id.items() if entries]
+
+    def get_menu_entries_for_config(self, menu_id=None):
+        """ literally just call toml.dumps() on this.  Only menu_id's entries, if given """
+        menu_ids = self.menu_ids() if menu_id is None else [menu_id]
+
+        captions_by_menu_id = {}
+        for m in menu_ids:
             # if we're a menu entry that isn't in a page/file, it must be written to config
             # i.e. it's a caption.
-            if self.menu_entries_by_identifier[k].md_relpath is not None:
-                continue
+            captions = sorted(identifier for identifier, menu_entry in self.menu_entries_by_menu_id.get(m, {}).items()
+                              if menu_entry.md_relpath is None)
+            if captions:
+                captions_by_menu_id[m] = captions
 
-            menu_id = self.menu_entries_by_identifier[k].menu_id
-            a = menu_entries_by_menu_id.get(menu_id, [])
-            a.append(self.menu_entries_by_identifier[k].to_dict())
-            menu_entries_by_menu_id[menu_id] = a
+        # Menus in the order of their first caption, as if all the captions were sorted together
+        menu_entries_by_menu_id = {}
+        for m in sorted(captions_by_menu_id, key=lambda m: captions_by_menu_id[m][0]):
+            menu_entries_by_menu_id[m] = [self.menu_entries_by_identifier[identifier].to_dict()
+                                          for identifier in captions_by_menu_id[m]]
 
         return menu_entries_by_menu_id
 
-    def get_front_matter_by_menu_id_by_file(self):
-        menu_ids = set() # corda-os-4-4, cenm-1-0 etc.
-        for __, menu_entry in self.menu_entries_by_identifier.items():
-            menu_ids.add(menu_entry.menu_id)
+    def get_front_matter_by_menu_id_by_file(self, menu_id=None):
+        """ { menu_id: { md_relpath: front matter } }, only for menu_id, if given """
+        menu_ids = self.menu_ids() if menu_id is None else [menu_id]
 
         d = {}
-        for menu_id in menu_ids:
+        for m in menu_ids:
             fd = {}
-            for __, menu_entry in self.menu_entries_by_identifier.items():
-                if not menu_entry.md_relpath or menu_entry.menu_id != menu_id:
+            for menu_entry in self.menu_entries_by_menu_id.get(m, {}).values():
+                if not menu_entry.md_relpath:
                     continue  # it's a caption
                 fd[menu_entry.md_relpath] = menu_entry.to_front_matter_entry()
-            d[menu_id] = fd
+            d[m] = fd
 
         return d
 
@@ -151,24 +160,146 @@ def _setup_logging():
     LOG.addHandler(ch)
 
 
-def parse_rst_files_for_menus():
+def parse_rst_files_for_menus(index_files=None, rst_index=None):
     """ Returns a 2-tuple of { version : menus } and { version: files{file: submenu} }
+
+    Reads the given rst files, or globs all of them under repos/
     """
-    LOG.info("Globbing rst files")
-    index_files = [x for x in Path(REPOS).rglob('docs/source/**/*.rst')]
-    LOG.info("Globbing rst files finished")
+    if rst_index is None:
+        rst_index = RstIndex()
+
+    if index_files is None:
+        LOG.info("Globbing rst files")
+        index_files = [x for x in Path(REPOS).rglob('docs/source/**/*.rst')]
+        LOG.info("Globbing rst files finished")
 
     LOG.info("Building menus")
 
     menus_obj = Menus()
     for index_file in index_files:
-        parse_file_for_doctree(menus_obj, index_file)
+        parse_file_for_doctree(menus_obj, index_file, rst_index.directives(index_file))
 
     LOG.info("Building menus finished")
 
     return menus_obj.get_menu_entries_for_config(), menus_obj.get_front_matter_by_menu_id_by_file()
 
 
+def _menus_code_version():
+    """ Changes whenever the code that builds the menus changes """
+    with open(os.path.realpath(__file__), 'rb') as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+
+def _menu_slice_key(index_files, rst_index):
+    """ Everything one version's menus depend on:  which rst files it has, as toctrees can only point
+    at those, and the content of the ones with toctrees """
+    sha1 = hashlib.sha1()
+    sha1.update(_menus_code_version().encode())
+    for index_file in sorted(str(x) for x in index_files):
+        sha1.update(index_file.encode())
+        if filter_directives(rst_index.directives(index_file)):
+            sha1.update(rst_index.hash(index_file).encode())
+    return sha1.hexdigest()
+
+
+def parse_rst_files_for_menus_by_version(index_files, rst_index, cache_pathname=None):
+    """ Same 2-tuple as parse_rst_files_for_menus, but each version's menus are built on their own
+    and kept in cache_pathname, so only the versions whose toctrees changed are parsed again.
+
+    Returns the 2-tuple, and how many versions were parsed.
+    """
+    slices = {}
+    if cache_pathname and os.path.exists(cache_pathname):
+        try:
+            with open(cache_pathname, 'r') as f:
+                slices = json.load(f)
+        except (ValueError, OSError) as e:
+            LOG.warning(f"Ignoring unreadable menus cache {cache_pathname}: {e}")
+
+    files_by_menu_id = {}
+    for index_file in index_files:
+        files_by_menu_id.setdefault(version_for_config(index_file), []).append(index_file)
+
+    parsed = 0
+    new_slices = {}
+    for menu_id, files in sorted(files_by_menu_id.items()):
+        key = _menu_slice_key(files, rst_index)
+        menu_slice = slices.get(menu_id)
+        if not menu_slice or menu_slice["key"] != key:
+            menus_obj = Menus()
+            for index_file in files:
+                parse_file_for_doctree(menus_obj, index_file, rst_index.directives(index_file))
+            menu_slice = {"key": key,
+                          "config": menus_obj.get_menu_entries_for_config(menu_id).get(menu_id, []),
+                          "files": menus_obj.get_front_matter_by_menu_id_by_file(menu_id).get(menu_id, {})}
+            parsed += 1
+        new_slices[menu_id] = menu_slice
+
+    if cache_pathname and new_slices != slices:
+        os.makedirs(os.path.dirname(cache_pathname), exist_ok=True)
+        tmp_pathname = cache_pathname + ".tmp"
+        with open(tmp_pathname, 'w') as f:
+            json.dump(new_slices, f)
+        os.replace(tmp_pathname, cache_pathname)
+
+    # Menus in the order of their first caption, same as Menus.get_menu_entries_for_config()
+    config = {menu_id: new_slices[menu_id]["config"]
+              for menu_id in sorted((m for m in new_slices if new_slices[m]["config"]),
+                                    key=lambda m: new_slices[m]["config"][0]["identifier"])}
+    files = {menu_id: menu_slice["files"] for menu_id, menu_slice in new_slices.items()}
+    return (config, files), parsed
+
+
+def write_if_changed(pathname, text):
+    """ Returns True if it was written """
+    if os.path.exists(pathname):
+        with open(pathname, 'r') as f:
+            if f.read() == text:
+                return False
+    with open(pathname, 'w') as f:
+        f.write(text)
+    return True
+
+
+def write_split_menus(config, files, dest_dir=MENUS_DIR, remove_stale=True):
+    """ Writes the menus as dest_dir/<menu_id>/menus.en.json, one hugo config file per version with the same
+    captions as menus.en.toml, plus dest_dir/index.csv listing them, so a version can be loaded without the rest.
+
+    Each file has just that version's captions, the pages' entries stay in their front matter.  Only the files
+    that changed are written, returns how many were.
+    """
+    os.makedirs(dest_dir, exist_ok=True)
+    index_pathname = os.path.join(dest_dir, MENUS_INDEX)
+    old_menus = {}
+    if os.path.exists(index_pathname):
+        with open(index_pathname, 'r') as f:
+            old_menus = {row["menu_id"]: row for row in csv.DictReader(f, delimiter=';')}
+
+    written = 0
+    menus = {}
+    for menu_id in sorted(set(config) | set(files)):
+        text = json.dumps({menu_id: config.get(menu_id, [])}, separators=(',', ':'), sort_keys=True)
+        filename = os.path.join(menu_id, "menus.en.json")
+        os.makedirs(os.path.join(dest_dir, menu_id), exist_ok=True)
+        written += write_if_changed(os.path.join(dest_dir, filename), text)
+        menus[menu_id] = {"menu_id": menu_id, "file": filename, "captions": len(config.get(menu_id, [])),
+                          "pages": len(files.get(menu_id, {})), "sha1": hashlib.sha1(text.encode()).hexdigest()}
+
+    if remove_stale:
+        for menu_id in set(old_menus) - set(menus):
+            shutil.rmtree(os.path.join(dest_dir, menu_id), ignore_errors=True)
+    else:
+        menus = {**old_menus, **menus}
+
+    with io.StringIO() as f:
+        writer = csv.DictWriter(f, ["menu_id", "file", "captions", "pages", "sha1"], delimiter=';',
+                                lineterminator='\n')
+        writer.writeheader()
+        writer.writerows(menus[menu_id] for menu_id in sorted(menus))
+        written += write_if_changed(index_pathname, f.getvalue())
+    return written
+
+
 def repo_and_version(filename):
     dirs = str(filename).split("/")
     while dirs[0] != "docs":
@@ -218,13 +349,13 @@ def _get_page_identifier(version_prefix, file):
     return version_prefix + "-" + filename.lower().replace(" ", "-").replace("&", "and")
 
 
-def parse_file_for_doctree(menus, file):
+def parse_file_for_doctree(menus, file, directives=None):
     """ Returns a 2-tuple of { version : menus } and { version: files } where files = {file: submenu} }
     Files have '.md' suffix
     """
 
     # Only doctree directives
-    directives = filter_directives(parse_rst(file))
+    directives = filter_directives(parse_rst(file) if directives is None else directives)
 
     if not directives:
         return
@@ -319,29 +450,8 @@ def _is_index_page(file):
 def parse_rst(index_file):
     """  Really rough parsing - just want 'toctree'  """
     LOG.info(f"Parsing {index_file}")
-    directives = []
-
-    lines = open(index_file, 'r').readlines()
-
-    directive = None
-    for line in lines:
-        if line.lstrip().startswith(".."):
-            if directive:
-                directives.append(directive)  # append previous one to list
-            directive = Directive()  # create new
-            directive.parse(line)
-        elif directive and (line.lstrip() != line or line.strip() == ""):
-            directive.parse(line)  # line is part of current directive
-        else:
-            # we've left a directive
-            if directive:
-                directives.append(directive)
-                directive = None
-
-    if directive:
-        directives.append(directive)
-
-    return directives
+    with open(index_file, 'r') as f:
+        return parse_directives(f)
 
 
 def main():
@@ -349,14 +459,27 @@ def main():
 
     desc = "Rebuild menus.en.toml from all rst files"
     parser = argparse.ArgumentParser(description=desc)
+    parser.add_argument("menu_id", nargs="*", help="only print these menus, e.g. corda-os-4-4")
+    parser.add_argument("--split", nargs="?", const=MENUS_DIR, default=None, metavar="DIR",
+                        help=f"write a hugo config file per version and an {MENUS_INDEX} to DIR (default {MENUS_DIR}) "
+                             "rather than printing toml")
 
     ARGS = parser.parse_args()
 
     _setup_logging()
 
-    a, b = parse_rst_files_for_menus()
+    index_files = None
+    if ARGS.menu_id:
+        # Only parse the versions we're printing
+        index_files = [x for x in Path(REPOS).rglob('docs/source/**/*.rst') if version_for_config(x) in ARGS.menu_id]
 
-    print(toml.dumps(a))
+    a, b = parse_rst_files_for_menus(index_files)
+
+    if ARGS.split:
+        written = write_split_menus(a, b, ARGS.split, remove_stale=not ARGS.menu_id)
+        LOG.info(f"Wrote {written} files to {ARGS.split}")
+    else:
+        print(toml.dumps(a))
 
 
 if __name__ == "__main__":
@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+
+import hashlib
+import io
+import json
+import logging
+import os
+import re
+import sys
+
+LOG = logging.getLogger(__name__)
+
+# The only directives anything reads from the rst
+INDEXED_DIRECTIVES = ['toctree', 'conditional-toctree', 'literalinclude']
+
+# Bump when parsing changes, so the cache is rebuilt
+INDEX_VERSION = 1
+
+_ARG_WITH_VALUE = re.compile(r":(.*):\s+(.*)")
+_ARG = re.compile(r":(.*):")
+_MAY_HAVE_INDEXED_DIRECTIVE = re.compile("|".join(re.escape(name) for name in INDEXED_DIRECTIVES))
+
+
+class Directive:
+    __slots__ = ('args', 'name', 'value', 'inner')
+
+    def __init__(self):
+        self.args = {}
+        self.name = None
+        self.value = None
+        self.inner = []
+
+    def parse(self, line):
+        # The opening directive
+        if line.strip().startswith(".."):
+            parts = line.split("::")
+            self.name = sys.intern(parts[0].replace("..", "").strip())
+            if len(parts) > 1:
+                self.value = parts[1].strip()
+            return
+
+        # A parameter
+        if line.strip().startswith(":"):
+            matches = _ARG_WITH_VALUE.match(line.strip())
+            if matches:
+                self.args[sys.intern(matches.group(1))] = matches.group(2)
+            else:
+                matches = _ARG.match(line.strip())
+                if matches:
+                    self.args[sys.intern(matches.group(1))] = "true"
+
+            return
+
+        # Content
+        self.inner.append(line.strip())
+
+    def to_json(self):
+        return [self.name, self.value, self.args, self.inner]
+
+    @classmethod
+    def from_json(cls, data):
+        directive = cls()
+        directive.name, directive.value, directive.args, directive.inner = data
+        directive.name = sys.intern(directive.name)
+        directive.args = {sys.intern(k): v for k, v in directive.args.items()}
+        return directive
+
+
+def parse_directives(lines, names=None):
+    """  Really rough parsing of the directives in some rst, optionally only those called names.
+
+    A directive is a line starting '..', then any indented or blank lines that follow.
+    """
+    directives = []
+    directive = None
+    in_directive = False
+    for line in lines:
+        if line.lstrip().startswith(".."):
+            directive = Directive()
+            directive.parse(line)
+            in_directive = True
+            if names is not None and directive.name not in names:
+                directive = None  # skip over it, without parsing the rest
+            else:
+                directives.append(directive)
+        elif in_directive and (line.lstrip() != line or line.strip() == ""):
+            if directive:
+                directive.parse(line)  # line is part of current directive
+        else:
+            # we've left a directive
+            in_directive = False
+            directive = None
+
+    return directives
+
+
+class RstIndex:
+    """ The toctree and literalinclude directives of each rst file, parsed once and shared.
+
+    Saved to cache_pathname, keyed by a hash of each file's content (checked only if
+    its mtime or size changed), so unchanged files are never read or parsed again.
+    """
+
+    def __init__(self, cache_pathname=None):
+        self.cache_pathname = cache_pathname
+        self.entries = {}
+        self.parsed = 0
+        if cache_pathname and os.path.exists(cache_pathname):
+            try:
+                with open(cache_pathname, 'r') as f:
+                    data = json.load(f)
+                if data.get("version") == INDEX_VERSION:
+                    self.entries = data["files"]
+            except (ValueError, KeyError, OSError) as e:
+                LOG.warning(f"Ignoring unreadable rst index {cache_pathname}: {e}")
+        self.directives_by_file = {}
+
+    def _entry(self, filename):
+        st = os.stat(filename)
+        entry = self.entries.get(filename)
+        if entry and entry["mtime"] == st.st_mtime_ns and entry["size"] == st.st_size:
+            return entry
+
+        with open(filename, 'rb') as f:
+            data = f.read()
+        digest = hashlib.md5(data).hexdigest()
+        if not entry or entry["hash"] != digest:
+            # Decoded just like open(filename, 'r') would
+            text = io.TextIOWrapper(io.BytesIO(data)).read()
+            directives = []
+            if _MAY_HAVE_INDEXED_DIRECTIVE.search(text):
+                directives = parse_directives(io.StringIO(text), INDEXED_DIRECTIVES)
+            entry = {"hash": digest, "directives": [d.to_json() for d in directives]}
+            self.parsed += 1
+
+        entry["mtime"] = st.st_mtime_ns
+        entry["size"] = st.st_size
+        self.entries[filename] = entry
+        return entry
+
+    def directives(self, filename):
+        """ The indexed directives in filename, in order """
+        filename = str(filename)
+        directives = self.directives_by_file.get(filename)
+        if directives is None:
+            directives = [Directive.from_json(d) for d in self._entry(filename)["directives"]]
+            self.directives_by_file[filename] = directives
+        return directives
+
+    def hash(self, filename):
+        """ md5 of the file's content """
+        filename = str(filename)
+        self.directives(filename)
+        return self.entries[filename]["hash"]
+
+    def save(self):
+        """ Only keeps the files looked at in this run """
+        if not self.cache_pathname:
+            return
+        os.makedirs(os.path.dirname(self.cache_pathname), exist_ok=True)
+        files = {filename: self.entries[filename] for filename in self.directives_by_file}
+        tmp_pathname = self.cache_pathname + ".tmp"
+        with open(tmp_pathname, 'w') as f:
+            json.dump({"version": INDEX_VERSION, "files": files}, f)
+        os.replace(tmp_pathname, self.cache_pathname)
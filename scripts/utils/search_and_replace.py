@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+
+import logging
+import os
+import re
+import shutil
+import tempfile
+
+LOG = logging.getLogger(__name__)
+
+
+def _trie_pattern(node):
+    """ Regex for a trie of characters, where the key '' marks the end of a word.
+
+    Alternatives at each node start with different characters, so at most one can
+    match, and the optional group is greedy, so the longest word always wins.
+    """
+    alternatives = [re.escape(ch) + _trie_pattern(child) for ch, child in sorted(node.items()) if ch]
+    if not alternatives:
+        return ''
+
+    is_word_end = '' in node
+    if len(alternatives) == 1 and not is_word_end:
+        return alternatives[0]
+
+    return '(?:' + '|'.join(alternatives) + ')' + ('?' if is_word_end else '')
+
+
+def _compile(words):
+    trie = {}
+    for word in words:
+        node = trie
+        for ch in word:
+            node = node.setdefault(ch, {})
+        node[''] = {}
+    return re.compile(_trie_pattern(trie))
+
+
+def atomic_write(pathname, text):
+    """ Write to a temporary file alongside, then rename it over pathname,
+    so nothing ever sees a half written file """
+    fd, tmp_pathname = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(pathname)), prefix=".tmp-")
+    try:
+        with os.fdopen(fd, 'w', newline='') as f:
+            f.write(text)
+        if os.path.exists(pathname):
+            shutil.copymode(pathname, tmp_pathname)
+        os.replace(tmp_pathname, pathname)
+    except BaseException:
+        os.unlink(tmp_pathname)
+        raise
+
+
+class Replacer:
+    """ Replaces every occurrence of any number of strings in a single pass over the text.
+
+    All the strings are compiled into one regex, built from a trie of them, so the cost
+    per character doesn't grow with the number of replacements.  Where more than one
+    string matches at the same place, the longest wins.  Replacement text is never
+    itself searched again.
+    """
+
+    def __init__(self, replacements):
+        self.replacements = {}
+        for (value, new_value) in replacements:
+            if value:
+                self.replacements.setdefault(value, new_value)
+
+        self.regex = _compile(self.replacements.keys()) if self.replacements else None
+
+    def sub(self, text):
+        """ Returns (new text, number of replacements) """
+        if self.regex is None:
+            return text, 0
+        return self.regex.subn(lambda m: self.replacements[m.group(0)], text)
+
+    def replace_in_file(self, pathname):
+        """ Returns the number of replacements made.  The file is only rewritten if it changed. """
+        if not os.path.isfile(pathname):
+            return 0
+
+        LOG.debug(f"Checking {pathname}")
+        with open(pathname, 'r', newline='') as f:
+            text = f.read()
+
+        new_text, count = self.sub(text)
+        if new_text == text:
+            return 0
+
+        LOG.debug(f"Rewritten file {pathname} ({count} replacements)")
+        atomic_write(pathname, new_text)
+        return count
+
+    def replace_in_files(self, files):
+        """ Returns (number of files changed, total number of replacements) """
+        changed = 0
+        total = 0
+        for pathname in files:
+            count = self.replace_in_file(pathname)
+            if count:
+                changed += 1
+                total += count
+        return changed, total
+
+
+def search_and_replace(files, replacements):
+    """ Apply all the (value, new_value) replacements to each file, in one pass per file """
+    return Replacer(replacements).replace_in_files(files)